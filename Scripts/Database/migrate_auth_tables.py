@@ -40,6 +40,17 @@ with engine.connect() as conn:
             ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
         """))
         
+        # Optional profile fields edited from the profile page
+        conn.execute(text("""
+            ALTER TABLE users 
+            ADD COLUMN IF NOT EXISTS phone TEXT;
+        """))
+        
+        conn.execute(text("""
+            ALTER TABLE users 
+            ADD COLUMN IF NOT EXISTS avatar_url TEXT;
+        """))
+        
         # Migrate old google_id, facebook_id, apple_id to oauth_id (if columns exist)
         try:
             # Check if google_id column exists before trying to migrate
@@ -100,7 +111,7 @@ with engine.connect() as conn:
             CREATE TABLE IF NOT EXISTS refresh_tokens (
                 id SERIAL PRIMARY KEY,
                 user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                token VARCHAR(512) UNIQUE NOT NULL,
+                token_hash BYTEA UNIQUE NOT NULL,
                 expires_at TIMESTAMP NOT NULL,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 revoked BOOLEAN DEFAULT FALSE
@@ -112,12 +123,76 @@ with engine.connect() as conn:
             CREATE INDEX IF NOT EXISTS idx_refresh_tokens_user_id ON refresh_tokens(user_id);
         """))
         
+        conn.commit()
+        print("✓ Refresh tokens table created")
+    except Exception as e:
+        print(f"Warning: {e}")
+        conn.rollback()
+    
+    # Replace stored plaintext refresh tokens with their SHA-256 digests
+    print("Hashing stored refresh tokens...")
+    try:
         conn.execute(text("""
-            CREATE INDEX IF NOT EXISTS idx_refresh_tokens_token ON refresh_tokens(token);
+            ALTER TABLE refresh_tokens 
+            ADD COLUMN IF NOT EXISTS token_hash BYTEA;
+        """))
+        
+        result = conn.execute(text("""
+            SELECT column_name 
+            FROM information_schema.columns 
+            WHERE table_name = 'refresh_tokens' AND column_name = 'token';
+        """))
+        if result.fetchone():
+            conn.execute(text("""
+                UPDATE refresh_tokens 
+                SET token_hash = sha256(convert_to(token, 'UTF8')) 
+                WHERE token_hash IS NULL;
+            """))
+            conn.execute(text("""
+                ALTER TABLE refresh_tokens 
+                DROP COLUMN token;
+            """))
+        
+        conn.execute(text("""
+            ALTER TABLE refresh_tokens 
+            ALTER COLUMN token_hash SET NOT NULL;
+        """))
+        
+        conn.execute(text("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_refresh_tokens_token_hash ON refresh_tokens(token_hash);
         """))
         
         conn.commit()
-        print("✓ Refresh tokens table created")
+        print("✓ Refresh tokens hashed")
+    except Exception as e:
+        print(f"Warning: {e}")
+        conn.rollback()
+    
+    # Unique keys the signup and OAuth upserts rely on (ON CONFLICT needs them)
+    print("Adding unique indexes on users...")
+    try:
+        conn.execute(text("""
+            DO $$
+            BEGIN
+                IF NOT EXISTS (
+                    SELECT 1
+                    FROM pg_index i
+                    JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+                    WHERE i.indrelid = 'users'::regclass AND a.attname = 'email'
+                      AND i.indisunique AND i.indnatts = 1 AND i.indpred IS NULL
+                ) THEN
+                    CREATE UNIQUE INDEX users_email_ukey ON users(email);
+                END IF;
+            END $$;
+        """))
+        
+        conn.execute(text("""
+            CREATE UNIQUE INDEX IF NOT EXISTS users_oauth_ukey
+            ON users(oauth_provider, oauth_id) WHERE oauth_id IS NOT NULL;
+        """))
+        
+        conn.commit()
+        print("✓ Unique indexes on users added")
     except Exception as e:
         print(f"Warning: {e}")
         conn.rollback()
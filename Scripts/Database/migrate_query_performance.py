@@ -0,0 +1,342 @@
+"""
+Migration script for the indexes and derived columns the API's read queries rely on.
+Safe to re-run: every step checks for existing objects first.
+"""
+
+from Scripts.Database.db_connection import engine
+from sqlalchemy import text
+
+if __name__ == "__main__" and (__package__ is None or __package__ == ""):
+    print("Please run as module from project root:\n  python -m Scripts.Database.migrate_query_performance")
+    raise SystemExit(1)
+
+# Listing badges as (label, color): tiers by minimum Smart Living Score, highest first
+BADGE_TIERS = (
+    (90, ("Excellent Match", "#52D1C6")),
+    (85, ("High Score", "#2D9CDB")),
+)
+BADGE_BELOW_TIERS = ("New Listing", "#EF6C48")
+BADGE_UNSCORED = ("New Listing", "#F4A340")
+
+# Listing columns /user/saved and /user/viewed read, carried by the index on real_estate_data.no
+USER_LIST_COLUMNS = "price, location, num_rooms, num_bathrooms, floor_area_m2, smart_living_score, property_type"
+
+
+def _badge_case(field):
+    """SQL CASE picking the badge label (field 0) or color (field 1) for a row's score."""
+    whens = [f"WHEN smart_living_score IS NULL THEN '{BADGE_UNSCORED[field]}'"]
+    whens += [f"WHEN smart_living_score >= {minimum} THEN '{badge[field]}'" for minimum, badge in BADGE_TIERS]
+    return f"CASE {' '.join(whens)} ELSE '{BADGE_BELOW_TIERS[field]}' END"
+
+
+# (description, statements) pairs, executed in order
+STEPS = [
+    (
+        # Unique when the data allows it, so single-listing lookups plan as a unique index scan.
+        # It also carries the listing columns /user/saved and /user/viewed join by listing
+        # number, so those lookups are index-only scans without a second index on no
+        "Ensuring real_estate_data.no is indexed, covering the user-list columns",
+        [
+            f"""
+            DO $$
+            DECLARE
+                pkey_name text;
+            BEGIN
+                -- Earlier runs kept the covering columns in a separate index
+                DROP INDEX IF EXISTS public.idx_red_no_user_lists;
+
+                -- A primary key on no is the index to cover; rebuild it with the columns
+                SELECT c.conname INTO pkey_name
+                FROM pg_constraint c
+                JOIN pg_index i ON i.indexrelid = c.conindid
+                JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+                WHERE c.conrelid = 'public.real_estate_data'::regclass AND c.contype = 'p'
+                  AND a.attname = 'no' AND i.indnkeyatts = 1 AND i.indnatts = 1;
+                IF pkey_name IS NOT NULL THEN
+                    EXECUTE format(
+                        'ALTER TABLE public.real_estate_data DROP CONSTRAINT %I, '
+                        'ADD CONSTRAINT %I PRIMARY KEY (no) INCLUDE ({USER_LIST_COLUMNS})',
+                        pkey_name, pkey_name
+                    );
+                END IF;
+
+                -- This step's own indexes from earlier runs predate the covering columns
+                IF EXISTS (
+                    SELECT 1 FROM pg_index
+                    WHERE indexrelid IN (to_regclass('public.idx_red_no_unique'), to_regclass('public.idx_red_no_btree'))
+                      AND indnatts = 1
+                ) THEN
+                    DROP INDEX IF EXISTS public.idx_red_no_unique;
+                    DROP INDEX IF EXISTS public.idx_red_no_btree;
+                END IF;
+
+                IF NOT EXISTS (
+                    SELECT 1
+                    FROM pg_index i
+                    JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+                    WHERE i.indrelid = 'public.real_estate_data'::regclass AND a.attname = 'no'
+                ) THEN
+                    IF NOT EXISTS (
+                        SELECT 1 FROM public.real_estate_data GROUP BY no HAVING COUNT(*) > 1
+                    ) THEN
+                        CREATE UNIQUE INDEX idx_red_no_unique ON public.real_estate_data (no)
+                        INCLUDE ({USER_LIST_COLUMNS});
+                    ELSE
+                        CREATE INDEX idx_red_no_btree ON public.real_estate_data (no)
+                        INCLUDE ({USER_LIST_COLUMNS});
+                    END IF;
+                END IF;
+            END $$;
+            """,
+        ],
+    ),
+    (
+        # Serves the shared "ORDER BY smart_living_score DESC NULLS LAST, price ASC LIMIT n"
+        # as a top-N index scan; the predicate matches the queries' universal WHERE
+        "Indexing real_estate_data by score and price",
+        [
+            """
+            CREATE INDEX IF NOT EXISTS idx_real_estate_score_price
+            ON public.real_estate_data (smart_living_score DESC NULLS LAST, price ASC)
+            INCLUDE (no, property_type, location, latitude, longitude, floor_area_m2, floor_area, num_rooms, num_bathrooms)
+            WHERE price IS NOT NULL AND location IS NOT NULL;
+            """,
+        ],
+    ),
+    (
+        # Re-run after uploading new rows so their embeddings get filled in
+        "Building similarity embeddings on real_estate_data",
+        [
+            "CREATE EXTENSION IF NOT EXISTS vector;",
+            """
+            DO $$
+            DECLARE
+                type_names text[];
+                dims int;
+            BEGIN
+                SELECT COALESCE(array_agg(DISTINCT lower(property_type) ORDER BY lower(property_type)), '{}')
+                INTO type_names
+                FROM public.real_estate_data
+                WHERE property_type IS NOT NULL;
+
+                -- 7 standardized numeric features + one-hot property type
+                dims := 7 + cardinality(type_names);
+
+                -- Rebuild the column when the set of property types changed
+                IF EXISTS (
+                    SELECT 1 FROM pg_attribute
+                    WHERE attrelid = 'public.real_estate_data'::regclass
+                      AND attname = 'embedding' AND NOT attisdropped AND atttypmod <> dims
+                ) THEN
+                    ALTER TABLE public.real_estate_data DROP COLUMN embedding;
+                END IF;
+                EXECUTE format('ALTER TABLE public.real_estate_data ADD COLUMN IF NOT EXISTS embedding vector(%s)', dims);
+
+                WITH stats AS (
+                    SELECT
+                        AVG(ln(price + 1)) AS price_avg, NULLIF(STDDEV_POP(ln(price + 1)), 0) AS price_sd,
+                        AVG(num_rooms) AS rooms_avg, NULLIF(STDDEV_POP(num_rooms), 0) AS rooms_sd,
+                        AVG(num_bathrooms) AS baths_avg, NULLIF(STDDEV_POP(num_bathrooms), 0) AS baths_sd,
+                        AVG(COALESCE(floor_area_m2, floor_area)) AS area_avg,
+                        NULLIF(STDDEV_POP(COALESCE(floor_area_m2, floor_area)), 0) AS area_sd,
+                        AVG(smart_living_score) AS score_avg, NULLIF(STDDEV_POP(smart_living_score), 0) AS score_sd,
+                        AVG(latitude) AS lat_avg, NULLIF(STDDEV_POP(latitude), 0) AS lat_sd,
+                        AVG(longitude) AS lng_avg, NULLIF(STDDEV_POP(longitude), 0) AS lng_sd
+                    FROM public.real_estate_data
+                    WHERE price >= 0
+                )
+                UPDATE public.real_estate_data r
+                SET embedding = (
+                    ARRAY[
+                        -- Negative prices are left out of the stats and count as missing here,
+                        -- rather than aborting the step in ln()
+                        COALESCE((ln(CASE WHEN r.price >= 0 THEN r.price + 1 END) - s.price_avg) / s.price_sd, 0),
+                        COALESCE((r.num_rooms - s.rooms_avg) / s.rooms_sd, 0),
+                        COALESCE((r.num_bathrooms - s.baths_avg) / s.baths_sd, 0),
+                        COALESCE((COALESCE(r.floor_area_m2, r.floor_area) - s.area_avg) / s.area_sd, 0),
+                        COALESCE((r.smart_living_score - s.score_avg) / s.score_sd, 0),
+                        COALESCE((r.latitude - s.lat_avg) / s.lat_sd, 0),
+                        COALESCE((r.longitude - s.lng_avg) / s.lng_sd, 0)
+                    ]::float8[]
+                    -- A type mismatch costs more than any single standardized feature
+                    || ARRAY(
+                        SELECT CASE WHEN lower(r.property_type) = t.name THEN 2.0 ELSE 0.0 END::float8
+                        FROM unnest(type_names) WITH ORDINALITY AS t(name, position)
+                        ORDER BY t.position
+                    )
+                )::vector
+                FROM stats s;
+            END $$;
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_real_estate_embedding_hnsw
+            ON public.real_estate_data USING hnsw (embedding vector_l2_ops);
+            """,
+        ],
+    ),
+    (
+        "Adding indexed geography points to real_estate_data",
+        [
+            "CREATE EXTENSION IF NOT EXISTS postgis;",
+            """
+            ALTER TABLE public.real_estate_data
+            ADD COLUMN IF NOT EXISTS geom geography(Point, 4326)
+            GENERATED ALWAYS AS (ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)::geography) STORED;
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_real_estate_geom_gist
+            ON public.real_estate_data USING GIST (geom);
+            """,
+        ],
+    ),
+    (
+        # /search filters property_type by equality on LOWER(property_type) and amenities by a
+        # '%term%' substring, which only a trigram index can serve. Location is searched through
+        # search_tsv and city_normalized, so its LIKE indexes from earlier runs are dropped
+        "Indexing lowercased property_type and amenities for /search filters",
+        [
+            "DROP INDEX IF EXISTS public.idx_real_estate_location_lower;",
+            "DROP INDEX IF EXISTS public.idx_real_estate_location_trgm;",
+            "DROP INDEX IF EXISTS public.idx_real_estate_property_type_trgm;",
+            "CREATE EXTENSION IF NOT EXISTS pg_trgm;",
+            """
+            CREATE INDEX IF NOT EXISTS idx_real_estate_property_type_lower
+            ON public.real_estate_data (LOWER(property_type) text_pattern_ops);
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_real_estate_amenities_trgm
+            ON public.real_estate_data USING GIN (LOWER(amenities) gin_trgm_ops);
+            """,
+        ],
+    ),
+    (
+        "Adding full-text search column to real_estate_data",
+        [
+            """
+            ALTER TABLE public.real_estate_data
+            ADD COLUMN IF NOT EXISTS search_tsv tsvector
+            GENERATED ALWAYS AS (
+                to_tsvector('simple', COALESCE(location, '') || ' ' || COALESCE(property_type, ''))
+            ) STORED;
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_real_estate_search_tsv
+            ON public.real_estate_data USING GIN (search_tsv);
+            """,
+        ],
+    ),
+    (
+        # Last comma-separated part of location, so city filters are an indexed equality
+        "Adding normalized city column to real_estate_data",
+        [
+            """
+            ALTER TABLE public.real_estate_data
+            ADD COLUMN IF NOT EXISTS city_normalized text
+            GENERATED ALWAYS AS (lower(trim(split_part(location, ',', -1)))) STORED;
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_real_estate_city_norm
+            ON public.real_estate_data (city_normalized);
+            """,
+        ],
+    ),
+    (
+        # Mirrors the labels /listings used to format per row; refreshed on every
+        # re-run, so re-run after uploads (or on a nightly schedule)
+        "Building the real_estate_listings_display materialized view",
+        [
+            # Views built before city_normalized existed are rebuilt with it
+            """
+            DO $$
+            BEGIN
+                IF to_regclass('public.real_estate_listings_display') IS NOT NULL AND NOT EXISTS (
+                    SELECT 1 FROM pg_attribute
+                    WHERE attrelid = 'public.real_estate_listings_display'::regclass
+                      AND attname = 'city_normalized' AND NOT attisdropped
+                ) THEN
+                    DROP MATERIALIZED VIEW public.real_estate_listings_display;
+                END IF;
+            END $$;
+            """,
+            """
+            CREATE MATERIALIZED VIEW IF NOT EXISTS public.real_estate_listings_display AS
+            SELECT
+                no,
+                location,
+                city_normalized,
+                price,
+                smart_living_score,
+                initcap(COALESCE(NULLIF(property_type, ''), 'Smart Home')) AS title,
+                '$' || to_char(price, 'FM999,999,999,999,990') AS price_label,
+                COALESCE(NULLIF(location, ''), 'Unknown') AS location_label,
+                CASE
+                    WHEN COALESCE(floor_area_m2, floor_area, 0) = 0 THEN '—'
+                    ELSE to_char(COALESCE(floor_area_m2, floor_area) * 10.7639, 'FM999,999,999,990') || ' sq ft'
+                END AS area_label,
+                COALESCE(trunc(num_rooms)::bigint || ' Bed', 'Beds N/A')
+                    || ' • ' || COALESCE(trunc(num_bathrooms)::bigint || ' Bath', 'Bath N/A') AS rooms_label,
+                COALESCE(trunc(smart_living_score)::bigint || ' Smart Score', 'Smart score coming soon') AS score_label,
+                {badge_label} AS badge_label,
+                {badge_color} AS badge_color
+            FROM public.real_estate_data
+            WHERE price IS NOT NULL
+              AND location IS NOT NULL;
+            """.format(badge_label=_badge_case(0), badge_color=_badge_case(1)),
+            # Required for REFRESH ... CONCURRENTLY
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_listings_display_no
+            ON public.real_estate_listings_display (no);
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_listings_display_score_price
+            ON public.real_estate_listings_display (smart_living_score DESC NULLS LAST, price ASC);
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_listings_display_city_norm
+            ON public.real_estate_listings_display (city_normalized);
+            """,
+            "REFRESH MATERIALIZED VIEW CONCURRENTLY public.real_estate_listings_display;",
+        ],
+    ),
+    (
+        # The /user list endpoints read one user's rows newest first; these serve them in index order
+        "Indexing saved_properties and user_interactions per user by recency",
+        [
+            """
+            CREATE INDEX IF NOT EXISTS idx_saved_user_created
+            ON public.saved_properties (user_id, created_at DESC);
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_ui_user_type_created
+            ON public.user_interactions (user_id, interaction_type, created_at DESC);
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_ui_user_created
+            ON public.user_interactions (user_id, created_at DESC);
+            """,
+        ],
+    ),
+    (
+        # Last, since the generated columns above rewrite the table: index-only scans on the
+        # covering index of step 1 need a current visibility map
+        "Refreshing real_estate_data's visibility map and statistics",
+        [
+            "VACUUM (ANALYZE) public.real_estate_data;",
+        ],
+    ),
+]
+
+print("Starting query performance migration...")
+
+# Autocommit so a failing step doesn't roll back the ones before it
+with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+    for description, statements in STEPS:
+        print(f"{description}...")
+        try:
+            for statement in statements:
+                conn.execute(text(statement))
+            print(f"✓ {description}")
+        except Exception as e:
+            print(f"Warning: {e}")
+
+print("\n✓ Migration completed successfully!")
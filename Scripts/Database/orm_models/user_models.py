@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, Float, String, Boolean, TIMESTAMP, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, Float, String, Boolean, TIMESTAMP, ForeignKey, DateTime, LargeBinary
 from sqlalchemy.sql import func
 from sqlalchemy.orm import declarative_base
 
@@ -19,6 +19,10 @@ class User(Base):
     oauth_provider = Column(String(50), nullable=True)  # "google", "facebook", "apple"
     oauth_id = Column(String(255), nullable=True)  # Provider's user ID
 
+    # Optional profile fields
+    phone = Column(String, nullable=True)
+    avatar_url = Column(String, nullable=True)
+
     # Timestamps
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -60,7 +64,7 @@ class RefreshToken(Base):
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
-    token = Column(String(512), unique=True, nullable=False, index=True)
+    token_hash = Column(LargeBinary(32), unique=True, nullable=False, index=True)  # SHA-256 of the token
     expires_at = Column(DateTime(timezone=True), nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     revoked = Column(Boolean, default=False)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The API is imported as the top-level "app" package, as uvicorn runs it from website/backend
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "website", "backend"))
@@ -0,0 +1,145 @@
+import asyncio
+
+import pytest
+
+from app.cache import TTLCache, cache_key, cached
+
+
+def test_concurrent_misses_run_the_function_once():
+    calls = []
+
+    @cached(TTLCache(ttl=60))
+    async def fetch(key):
+        calls.append(key)
+        await asyncio.sleep(0.05)
+        return [key]
+
+    async def main():
+        return await asyncio.gather(*(fetch("a") for _ in range(10)))
+
+    assert asyncio.run(main()) == [["a"]] * 10
+    assert calls == ["a"]
+
+
+def test_hits_are_served_from_the_cache():
+    calls = []
+
+    @cached(TTLCache(ttl=60))
+    async def fetch(key):
+        calls.append(key)
+        return [key]
+
+    async def main():
+        await fetch("a")
+        await fetch("a")
+        await fetch(key="a")
+
+    asyncio.run(main())
+    # Positional and keyword calls are cached separately
+    assert calls == ["a", "a"]
+
+
+def test_pop_during_a_fill_discards_its_result():
+    cache = TTLCache(ttl=60)
+    source = {"value": "old"}
+    calls = []
+
+    @cached(cache, cache_if=None)
+    async def fetch(key):
+        value = source["value"]
+        calls.append(value)
+        await asyncio.sleep(0.05)
+        return value
+
+    async def main():
+        stale = asyncio.create_task(fetch(1))
+        await asyncio.sleep(0.01)
+        source["value"] = "new"
+        cache.pop(cache_key(1))
+        # Started after the pop, so it must not join the stale fill
+        fresh = asyncio.create_task(fetch(1))
+        return await stale, await fresh, await fetch(1)
+
+    assert asyncio.run(main()) == ("old", "new", "new")
+    assert calls == ["old", "new"]
+
+
+def test_results_failing_cache_if_are_not_cached():
+    calls = []
+
+    @cached(TTLCache(ttl=60))
+    async def fetch():
+        calls.append(1)
+        return []
+
+    async def main():
+        await fetch()
+        await fetch()
+
+    asyncio.run(main())
+    assert len(calls) == 2
+
+
+def test_exceptions_are_not_cached_and_reach_every_waiter():
+    calls = []
+
+    @cached(TTLCache(ttl=60))
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        if len(calls) == 1:
+            raise RuntimeError("neon down")
+        return ["ok"]
+
+    async def main():
+        results = await asyncio.gather(fetch(), fetch(), return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+        return await fetch()
+
+    assert asyncio.run(main()) == ["ok"]
+    assert len(calls) == 2
+
+
+def test_cancelled_waiter_does_not_cancel_the_fill():
+    calls = []
+
+    @cached(TTLCache(ttl=60))
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return ["ok"]
+
+    async def main():
+        owner = asyncio.create_task(fetch())
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(fetch())
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return await owner
+
+    assert asyncio.run(main()) == ["ok"]
+    assert calls == [1]
+
+
+def test_entries_expire_and_the_oldest_is_evicted():
+    cache = TTLCache(ttl=60, maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.set("c", 3)
+    assert cache.get("a") is None
+    assert cache.get("c") == 3
+
+    cache.set("d", 4, ttl=0)
+    assert cache.get("d", "missing") == "missing"
+
+
+def test_set_with_an_outdated_version_is_dropped():
+    cache = TTLCache(ttl=60)
+    version = cache.version("k")
+    cache.pop("k")
+    cache.set("k", "stale", version=version)
+    assert cache.get("k") is None
+    cache.set("k", "fresh", version=cache.version("k"))
+    assert cache.get("k") == "fresh"
@@ -0,0 +1,90 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+from app.cache import PREFERENCES_CACHE
+from app.routers import user
+
+
+@pytest.fixture(autouse=True)
+def empty_buffer():
+    user._pending_views.clear()
+    yield
+    user._pending_views.clear()
+
+
+def _buffer_views(*pairs):
+    now = datetime.now(timezone.utc)
+    user._pending_views.extend((user_id, property_id, now) for user_id, property_id in pairs)
+
+
+def test_failed_batch_is_retried_once(monkeypatch):
+    attempts = []
+
+    async def flaky(params):
+        attempts.append(params)
+        if len(attempts) == 1:
+            raise RuntimeError("connection reset")
+
+    monkeypatch.setattr(user, "log_views", flaky)
+    PREFERENCES_CACHE.set(7, {"stale": True})
+    _buffer_views((7, 1), (7, 2))
+
+    asyncio.run(user.flush_views())
+
+    assert len(attempts) == 2
+    assert attempts[1]["property_ids"] == [1, 2]
+    assert not user._pending_views
+    assert PREFERENCES_CACHE.get(7) is None
+
+
+def test_batch_failing_twice_is_dropped(monkeypatch):
+    attempts = []
+
+    async def broken(params):
+        attempts.append(params)
+        raise RuntimeError("database unreachable")
+
+    monkeypatch.setattr(user, "log_views", broken)
+    _buffer_views((7, 1))
+
+    asyncio.run(user.flush_views())
+
+    assert len(attempts) == 2
+    assert not user._pending_views
+
+
+def test_batches_are_split_at_batch_size(monkeypatch):
+    sizes = []
+
+    async def record(params):
+        sizes.append(len(params["user_ids"]))
+
+    monkeypatch.setattr(user, "log_views", record)
+    monkeypatch.setattr(user, "VIEW_FLUSH_BATCH_SIZE", 2)
+    _buffer_views((1, 1), (1, 2), (1, 3))
+
+    asyncio.run(user.flush_views())
+
+    assert sizes == [2, 1]
+
+
+def test_cancelled_batch_is_put_back_in_order(monkeypatch):
+    async def hang(params):
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(user, "log_views", hang)
+    _buffer_views((1, 1), (1, 2))
+    buffered = list(user._pending_views)
+
+    async def main():
+        flush = asyncio.create_task(user.flush_views())
+        await asyncio.sleep(0.01)
+        flush.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await flush
+
+    asyncio.run(main())
+
+    assert list(user._pending_views) == buffered
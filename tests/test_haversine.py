@@ -0,0 +1,38 @@
+import math
+
+import numpy as np
+import pytest
+
+from app.main import EARTH_RADIUS_KM, _haversine_km
+
+
+def test_known_distances():
+    # One degree of longitude on the equator
+    assert _haversine_km(0, 0, 0, 1) == pytest.approx(2 * math.pi * EARTH_RADIUS_KM / 360)
+    # London to Paris
+    assert _haversine_km(51.5074, -0.1278, 48.8566, 2.3522) == pytest.approx(343.5, abs=0.5)
+    # Antipodes
+    assert _haversine_km(0, 0, 0, 180) == pytest.approx(math.pi * EARTH_RADIUS_KM)
+
+
+def test_same_point_is_zero_and_distance_is_symmetric():
+    assert _haversine_km(32.77, -96.8, 32.77, -96.8) == pytest.approx(0.0)
+    assert _haversine_km(32.77, -96.8, 30.27, -97.74) == pytest.approx(_haversine_km(30.27, -97.74, 32.77, -96.8))
+
+
+def test_scalar_origin_against_arrays():
+    lats, lngs = [0.0, 0.0, 1.0], [0.0, 1.0, 0.0]
+    distances = _haversine_km(0, 0, lats, lngs)
+    assert distances.shape == (3,)
+    assert distances[0] == pytest.approx(0.0)
+    assert distances[1] == pytest.approx(distances[2])
+
+
+def test_broadcasts_to_a_distance_matrix():
+    lats, lngs = np.array([0.0, 10.0]), np.array([0.0, 20.0])
+    poi_lats, poi_lngs = np.array([0.0, 5.0, 10.0]), np.array([0.0, 5.0, 20.0])
+    matrix = _haversine_km(lats[:, None], lngs[:, None], poi_lats[None, :], poi_lngs[None, :])
+    assert matrix.shape == (2, 3)
+    for i in range(2):
+        for j in range(3):
+            assert matrix[i, j] == pytest.approx(_haversine_km(lats[i], lngs[i], poi_lats[j], poi_lngs[j]))
@@ -0,0 +1,50 @@
+import time
+
+from app.routers import auth as auth_routes
+from app.routers.auth import OAUTH_STATE_MAX_AGE_SECONDS, _sign_oauth_state, create_oauth_state, verify_oauth_state
+
+
+def _nonce(state):
+    return state.split(".", 1)[0]
+
+
+def test_fresh_state_with_matching_cookie_is_accepted():
+    state = create_oauth_state()
+    assert verify_oauth_state(state, _nonce(state))
+
+
+def test_tampered_state_is_rejected():
+    state = create_oauth_state()
+    nonce, issued_at, signature = state.split(".")
+    forged = f"{nonce}.{int(issued_at) + 1}.{signature}"
+    assert not verify_oauth_state(forged, nonce)
+
+
+def test_expired_state_is_rejected():
+    payload = f"abc.{int(time.time()) - OAUTH_STATE_MAX_AGE_SECONDS - 1}"
+    assert not verify_oauth_state(f"{payload}.{_sign_oauth_state(payload)}", "abc")
+
+
+def test_mismatched_or_missing_cookie_is_rejected():
+    state = create_oauth_state()
+    assert not verify_oauth_state(state, "someone-elses-nonce")
+    assert not verify_oauth_state(state, None)
+
+
+def test_non_ascii_input_is_rejected_not_raised():
+    state = create_oauth_state()
+    assert not verify_oauth_state("abc.1.é", "abc")
+    assert not verify_oauth_state(state, "é")
+
+
+def test_malformed_state_is_rejected():
+    for state in (None, "", "abc", "abc.notanumber.sig", "a.b.c.d"):
+        assert not verify_oauth_state(state, "abc")
+
+
+def test_login_redirect_pins_nonce_in_cookie():
+    state = create_oauth_state()
+    response = auth_routes.oauth_login_redirect("https://provider.example/auth", state)
+    cookie = response.headers["set-cookie"]
+    assert cookie.startswith(f"{auth_routes.OAUTH_STATE_COOKIE}={_nonce(state)};")
+    assert "HttpOnly" in cookie and "SameSite=lax" in cookie
@@ -0,0 +1,93 @@
+import asyncio
+import os
+import uuid
+
+import pytest
+from sqlalchemy import text
+
+pytestmark = pytest.mark.skipif(not os.getenv("DATABASE_URL"), reason="needs DATABASE_URL")
+
+from app.auth import create_refresh_token, revoke_refresh_token, rotate_refresh_token, save_refresh_token
+from app.database import get_engine
+
+
+def run(coro):
+    async def main():
+        try:
+            return await coro
+        finally:
+            # The engine's pooled connections belong to this test's event loop
+            await get_engine().dispose()
+
+    return asyncio.run(main())
+
+
+@pytest.fixture
+def user_id():
+    async def create():
+        async with get_engine().begin() as conn:
+            return (await conn.execute(
+                text("INSERT INTO users (email, name, oauth_provider) VALUES (:email, 'Test', 'email') RETURNING id"),
+                {"email": f"rotate-{uuid.uuid4().hex[:12]}@example.com"},
+            )).scalar_one()
+
+    async def delete(user_id):
+        async with get_engine().begin() as conn:
+            await conn.execute(text("DELETE FROM refresh_tokens WHERE user_id = :id"), {"id": user_id})
+            await conn.execute(text("DELETE FROM users WHERE id = :id"), {"id": user_id})
+
+    user_id = run(create())
+    yield user_id
+    run(delete(user_id))
+
+
+def _new_token(user_id):
+    return create_refresh_token(data={"sub": str(user_id)})
+
+
+def test_rotation_is_single_use(user_id):
+    old, new, newer = _new_token(user_id), _new_token(user_id), _new_token(user_id)
+
+    async def main():
+        await save_refresh_token(user_id, old)
+        first = await rotate_refresh_token(old, new)
+        replay = await rotate_refresh_token(old, newer)
+        chained = await rotate_refresh_token(new, newer)
+        return first, replay, chained
+
+    first, replay, chained = run(main())
+    assert first["id"] == user_id
+    assert replay is None
+    assert chained["id"] == user_id
+
+
+def test_concurrent_redemptions_succeed_once(user_id):
+    old = _new_token(user_id)
+
+    async def main():
+        await save_refresh_token(user_id, old)
+        return await asyncio.gather(*(rotate_refresh_token(old, _new_token(user_id)) for _ in range(5)))
+
+    results = run(main())
+    assert sum(result is not None for result in results) == 1
+
+
+def test_expired_revoked_and_unknown_tokens_are_rejected(user_id):
+    expired, revoked = _new_token(user_id), _new_token(user_id)
+
+    async def main():
+        await save_refresh_token(user_id, expired)
+        await save_refresh_token(user_id, revoked)
+        await revoke_refresh_token(revoked)
+        async with get_engine().begin() as conn:
+            await conn.execute(
+                text("UPDATE refresh_tokens SET expires_at = now() - interval '1 day' WHERE user_id = :id AND revoked IS NOT TRUE"),
+                {"id": user_id},
+            )
+        return (
+            await rotate_refresh_token(expired, _new_token(user_id)),
+            await rotate_refresh_token(revoked, _new_token(user_id)),
+            await rotate_refresh_token(_new_token(user_id), _new_token(user_id)),
+        )
+
+    assert run(main()) == (None, None, None)
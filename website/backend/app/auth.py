@@ -5,7 +5,12 @@ Handles JWT tokens, password hashing, and user authentication.
 
 from __future__ import annotations
 
+import asyncio
+import hashlib
 import os
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 
@@ -13,10 +18,11 @@ import bcrypt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import JWTError, jwt
-from sqlalchemy import create_engine, text
-from sqlalchemy.engine import Engine
+from sqlalchemy import text
 
 from dotenv import load_dotenv
+from app.cache import ACCESS_TOKEN_CLAIMS_CACHE
+from app.database import get_engine
 
 load_dotenv()
 
@@ -26,32 +32,94 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 15
 REFRESH_TOKEN_EXPIRE_DAYS = 7
 
+# Password limits: bcrypt ignores bytes past 72, and the cap keeps huge bodies from being encoded
+BCRYPT_MAX_PASSWORD_BYTES = 72
+PASSWORD_MAX_LENGTH = 1024
+
 # Security scheme
 security = HTTPBearer()
 
+# bcrypt releases the GIL while hashing, so threads spread logins across cores
+# without blocking the event loop
+PASSWORD_HASHING_POOL = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="bcrypt")
+
+# Issuing a refresh token at login is short-lived session state, so that write skips
+# waiting on the WAL flush (as a cache like Redis would); a crash can lose only the last
+# few hundred ms of logins, which then just sign in again. Joined into the statement so
+# relaxing the commit costs no extra round-trip. Rotation and logout revoke tokens, so
+# they stay fully durable: a crash must never make a spent or signed-out token valid again.
+RELAXED_COMMIT_SQL = "(SELECT set_config('synchronous_commit', 'off', true)) AS relaxed_commit"
+
+# SQL statements, compiled once
+SELECT_USER_BY_ID_STMT = text("SELECT id, email, name, oauth_provider FROM users WHERE id = :user_id")
+INSERT_REFRESH_TOKEN_STMT = text(f"""
+    INSERT INTO refresh_tokens (user_id, token_hash, expires_at)
+    SELECT :user_id, :token_hash, :expires_at
+    FROM {RELAXED_COMMIT_SQL}
+""")
+# Revokes the presented token only if it is still live, so a token can be redeemed once
+ROTATE_REFRESH_TOKEN_STMT = text("""
+    WITH revoked AS (
+        UPDATE refresh_tokens SET revoked = true
+        WHERE token_hash = :old_token_hash AND revoked IS NOT TRUE AND expires_at > :now
+        RETURNING user_id
+    ), saved AS (
+        INSERT INTO refresh_tokens (user_id, token_hash, expires_at)
+        SELECT user_id, :token_hash, :expires_at FROM revoked
+        RETURNING user_id
+    )
+    SELECT u.id, u.email, u.name, u.oauth_provider
+    FROM users u
+    JOIN saved ON saved.user_id = u.id
+""")
+REVOKE_REFRESH_TOKEN_STMT = text("""
+    UPDATE refresh_tokens SET revoked = true
+    WHERE token_hash = :token_hash
+""")
+
 
-def get_engine() -> Engine:
-    """Get database engine."""
-    database_url = os.getenv("DATABASE_URL")
-    if not database_url:
-        raise RuntimeError("DATABASE_URL environment variable is required.")
-    return create_engine(database_url, pool_pre_ping=True)
+def _password_bytes(password: str) -> bytes:
+    """Encode a password for bcrypt, which only ever reads the first 72 bytes."""
+    return password.encode("utf-8")[:BCRYPT_MAX_PASSWORD_BYTES]
 
 
 def hash_password(password: str) -> str:
     """Hash a password using bcrypt."""
     salt = bcrypt.gensalt()
-    return bcrypt.hashpw(password.encode("utf-8"), salt).decode("utf-8")
+    return bcrypt.hashpw(_password_bytes(password), salt).decode("utf-8")
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against its hash."""
     return bcrypt.checkpw(
-        plain_password.encode("utf-8"),
+        _password_bytes(plain_password),
         hashed_password.encode("utf-8")
     )
 
 
+async def hash_password_async(password: str) -> str:
+    """Hash a password on the password hashing pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(PASSWORD_HASHING_POOL, hash_password, password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password against its hash on the password hashing pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(PASSWORD_HASHING_POOL, verify_password, plain_password, hashed_password)
+
+
+def user_token_claims(user) -> dict:
+    """Access-token claims carrying the profile fields /auth/me returns, so it needs no query."""
+    # python-jose only accepts a string subject
+    return {
+        "sub": str(user["id"]),
+        "email": user["email"],
+        "name": user["name"],
+        "op": user["oauth_provider"],
+    }
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Create a JWT access token."""
     to_encode = data.copy()
@@ -69,11 +137,17 @@ def create_refresh_token(data: dict) -> str:
     """Create a JWT refresh token."""
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
-    to_encode.update({"exp": expire, "type": "refresh"})
+    # jti keeps tokens issued to the same user within one second distinct
+    to_encode.update({"exp": expire, "type": "refresh", "jti": secrets.token_urlsafe(16)})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 
+def hash_refresh_token(token: str) -> bytes:
+    """SHA-256 digest stored and looked up in place of the refresh token itself."""
+    return hashlib.sha256(token.encode("utf-8")).digest()
+
+
 def decode_token(token: str) -> dict:
     """Decode and verify a JWT token."""
     try:
@@ -90,38 +164,56 @@ def decode_token(token: str) -> dict:
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ) -> dict:
-    """Get the current authenticated user from JWT token."""
+    """Get the current authenticated user from the JWT access token's claims."""
     token = credentials.credentials
-    payload = decode_token(token)
-    
-    if payload.get("type") != "access":
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid token type",
-        )
+    payload = ACCESS_TOKEN_CLAIMS_CACHE.get(token)
+    if payload is None:
+        payload = decode_token(token)
+        
+        if payload.get("type") != "access":
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid token type",
+            )
+        
+        # Only verified tokens are cached, and never past their own expiry
+        ACCESS_TOKEN_CLAIMS_CACHE.set(token, payload, ttl=payload.get("exp", 0) - time.time())
     
-    user_id: int = payload.get("sub")
+    user_id = payload.get("sub")
     if user_id is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid token payload",
         )
     
-    # Fetch user from database
+    if "email" not in payload:
+        # Issued before access tokens carried the profile claims; read the row instead
+        return await load_user(int(user_id))
+    
+    return {
+        "id": int(user_id),
+        "email": payload.get("email"),
+        "name": payload.get("name"),
+        "oauth_provider": payload.get("op"),
+    }
+
+
+async def load_user(user_id: int) -> dict:
+    """Fetch a user's id, email, name and oauth_provider, or raise 401 if they are gone."""
     engine = get_engine()
-    with engine.connect() as conn:
-        result = conn.execute(
-            text("SELECT id, email, name, oauth_provider FROM users WHERE id = :user_id"),
+    async with engine.connect() as conn:
+        result = (await conn.execute(
+            SELECT_USER_BY_ID_STMT,
             {"user_id": user_id}
-        ).mappings().first()
-        
-        if result is None:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="User not found",
-            )
-        
-        return dict(result)
+        )).mappings().first()
+    
+    if result is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="User not found",
+        )
+    
+    return dict(result)
 
 
 async def get_current_user_optional(
@@ -136,68 +228,64 @@ async def get_current_user_optional(
         return None
 
 
-def save_refresh_token(user_id: int, token: str) -> None:
+async def save_refresh_token(user_id: int, token: str) -> None:
     """Save a refresh token to the database."""
     engine = get_engine()
     expires_at = datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
     
-    with engine.connect() as conn:
-        conn.execute(
-            text("""
-                INSERT INTO refresh_tokens (user_id, token, expires_at)
-                VALUES (:user_id, :token, :expires_at)
-            """),
+    async with engine.begin() as conn:
+        await conn.execute(
+            INSERT_REFRESH_TOKEN_STMT,
             {
                 "user_id": user_id,
-                "token": token,
+                "token_hash": hash_refresh_token(token),
                 "expires_at": expires_at
             }
         )
-        conn.commit()
 
 
-def revoke_refresh_token(token: str) -> None:
+async def rotate_refresh_token(old_token: str, new_token: str) -> Optional[dict]:
+    """Redeem a stored refresh token for its replacement and return the user, in one round-trip.
+
+    Returns None when the old token is unknown, revoked or expired.
+    """
+    engine = get_engine()
+    now = datetime.utcnow()
+    expires_at = now + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+
+    async with engine.begin() as conn:
+        result = (await conn.execute(
+            ROTATE_REFRESH_TOKEN_STMT,
+            {
+                "old_token_hash": hash_refresh_token(old_token),
+                "now": now,
+                "token_hash": hash_refresh_token(new_token),
+                "expires_at": expires_at
+            }
+        )).mappings().first()
+
+    return dict(result) if result else None
+
+
+async def revoke_refresh_token(token: str) -> None:
     """Revoke a refresh token."""
     engine = get_engine()
-    with engine.connect() as conn:
-        conn.execute(
-            text("UPDATE refresh_tokens SET revoked = true WHERE token = :token"),
-            {"token": token}
+    async with engine.begin() as conn:
+        await conn.execute(
+            REVOKE_REFRESH_TOKEN_STMT,
+            {"token_hash": hash_refresh_token(token)}
         )
-        conn.commit()
 
 
 def verify_refresh_token(token: str) -> Optional[dict]:
-    """Verify a refresh token and return user info if valid."""
+    """Check a refresh token's signature and type and return its user info if valid.
+
+    Whether it is still stored, unrevoked and unexpired is checked when it is rotated.
+    """
     try:
         payload = decode_token(token)
-        if payload.get("type") != "refresh":
-            return None
-        
-        # Check if token is revoked
-        engine = get_engine()
-        with engine.connect() as conn:
-            result = conn.execute(
-                text("""
-                    SELECT user_id, expires_at, revoked
-                    FROM refresh_tokens
-                    WHERE token = :token
-                """),
-                {"token": token}
-            ).mappings().first()
-            
-            if not result or result["revoked"]:
-                return None
-            
-            if datetime.utcnow() > result["expires_at"]:
-                return None
-            
-            return {"user_id": result["user_id"]}
-    except Exception:
+    except HTTPException:
         return None
-
-
-
-
-
-
+    if payload.get("type") != "refresh" or payload.get("sub") is None:
+        return None
+    return {"user_id": int(payload["sub"])}
@@ -0,0 +1,154 @@
+"""
+In-process caches shared by the API modules.
+Entries live per worker process and expire after a fixed TTL.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import functools
+import time
+from threading import Lock
+from typing import Any, Awaitable, Callable, Hashable, Optional, TypeVar
+
+T = TypeVar("T")
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Bounded dictionary cache whose entries expire after ``ttl`` seconds."""
+
+    def __init__(self, ttl: float, maxsize: int = 1024) -> None:
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries: dict[Hashable, tuple[float, Any]] = {}
+        # Bumped per key on every pop, so a fill that started before an invalidation
+        # can tell it is stale; bounded like the entries
+        self._versions: dict[Hashable, int] = {}
+        # Fills in progress per key, coalesced by ``cached``
+        self._inflight: dict[Hashable, asyncio.Future] = {}
+        self._lock = Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value for ``key`` or ``default`` if missing/expired."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            self._entries.pop(key, None)
+            return default
+        return value
+
+    def version(self, key: Hashable) -> int:
+        """How many times ``key`` has been invalidated (as far as this cache remembers)."""
+        return self._versions.get(key, 0)
+
+    def set(
+        self, key: Hashable, value: Any, ttl: Optional[float] = None, version: Optional[int] = None
+    ) -> None:
+        """Store ``value`` under ``key``, evicting the oldest entry when full.
+
+        If ``version`` is given and ``key`` has been invalidated since, the value is dropped.
+        """
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if version is not None and self._versions.get(key, 0) != version:
+                return
+            if key not in self._entries and len(self._entries) >= self.maxsize:
+                self._entries.pop(next(iter(self._entries)), None)
+            self._entries[key] = (expires_at, value)
+
+    def pop(self, key: Hashable) -> None:
+        """Invalidate ``key``, including any fill of it still in progress."""
+        with self._lock:
+            self._entries.pop(key, None)
+            self._inflight.pop(key, None)
+            self._versions[key] = self._versions.pop(key, 0) + 1
+            if len(self._versions) > self.maxsize:
+                self._versions.pop(next(iter(self._versions)), None)
+
+
+def cache_key(*args: Any, **kwargs: Any) -> Hashable:
+    """Key under which ``cached`` stores a call with these arguments."""
+    return (args, tuple(sorted(kwargs.items())))
+
+
+def cached(
+    cache: TTLCache, *, cache_if: Optional[Callable[[Any], bool]] = bool
+) -> Callable[[Callable[..., Awaitable[T]]], Callable[..., Awaitable[T]]]:
+    """Cache an async endpoint's return value in ``cache``, keyed by its arguments.
+
+    Results failing ``cache_if`` (by default: empty ones, which is what the
+    endpoints return when Neon errors) are passed through without being stored.
+    Raised exceptions are never cached.
+
+    Concurrent misses for the same key are coalesced: the first caller runs
+    ``func`` and the others await its outcome instead of repeating the query.
+    Popping the key while ``func`` runs discards its result and lets later
+    callers start a fresh query, so a write can't be undone by an older read.
+    """
+
+    def decorator(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        inflight = cache._inflight
+
+        # functools.wraps keeps the signature FastAPI reads query parameters from
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> T:
+            key = cache_key(*args, **kwargs)
+            value = cache.get(key, _MISSING)
+            if value is not _MISSING:
+                return value
+
+            pending = inflight.get(key)
+            if pending is not None:
+                # Shielded so one waiter disconnecting doesn't cancel it for the rest
+                return await asyncio.shield(pending)
+
+            pending = asyncio.get_running_loop().create_future()
+            # Mark the outcome retrieved so a failure with no waiters isn't logged as unhandled
+            pending.add_done_callback(lambda f: f.cancelled() or f.exception())
+            inflight[key] = pending
+            version = cache.version(key)
+            try:
+                value = await func(*args, **kwargs)
+            except asyncio.CancelledError:
+                pending.cancel()
+                raise
+            except BaseException as e:
+                pending.set_exception(e)
+                raise
+            else:
+                pending.set_result(value)
+            finally:
+                if inflight.get(key) is pending:
+                    del inflight[key]
+
+            if cache_if is None or cache_if(value):
+                cache.set(key, value, version=version)
+            return value
+
+        return wrapper
+
+    return decorator
+
+
+# Verified access-token claims per raw token; entries expire with the token
+ACCESS_TOKEN_CLAIMS_CACHE = TTLCache(ttl=15 * 60, maxsize=10_000)
+
+# OAuth providers' published id_token signing keys (JWKS), per keys URL
+OAUTH_JWKS_CACHE = TTLCache(ttl=24 * 60 * 60, maxsize=8)
+
+# Saved property ids per user_id (see cache_key); invalidated on save/unsave. Invalidation
+# only reaches this worker, so the short TTL bounds how stale other workers can be
+SAVED_IDS_CACHE = TTLCache(ttl=30, maxsize=10_000)
+
+# /user/me profile rows per user_id; invalidated on profile updates
+PROFILE_CACHE = TTLCache(ttl=120, maxsize=10_000)
+
+# Aggregated recommendation preferences per user_id; invalidated on save/view writes
+PREFERENCES_CACHE = TTLCache(ttl=120, maxsize=10_000)
+
+# Last successful /listings response per (city, limit), served while Neon is slow or down
+LISTINGS_FALLBACK_CACHE = TTLCache(ttl=24 * 60 * 60, maxsize=512)
@@ -0,0 +1,71 @@
+"""
+Async database engine shared by the API modules.
+Created once per worker process so requests check out pooled connections.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+from typing import Optional
+
+from dotenv import load_dotenv
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+load_dotenv()
+
+
+def _async_database_url(database_url: str) -> str:
+    """Point plain Postgres URLs (as handed out by Neon) at the async psycopg driver."""
+    for prefix in ("postgresql://", "postgres://"):
+        if database_url.startswith(prefix):
+            return "postgresql+psycopg://" + database_url[len(prefix):]
+    return database_url
+
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+# PgBouncer in transaction mode (Neon's "-pooler" endpoints, or DATABASE_PGBOUNCER=true)
+# hands each transaction to any server connection, so prepared statements can't be kept
+DATABASE_PGBOUNCER = (
+    os.getenv("DATABASE_PGBOUNCER", "").lower() in ("1", "true", "yes")
+    or "-pooler." in (DATABASE_URL or "")
+)
+# Behind PgBouncer the bouncer multiplexes server connections, so each worker keeps fewer
+POOL_SIZE = 5 if DATABASE_PGBOUNCER else 20
+
+# Connecting is deferred to first use, so importing without DATABASE_URL still works
+engine: Optional[AsyncEngine] = (
+    create_async_engine(
+        _async_database_url(DATABASE_URL),
+        pool_size=POOL_SIZE,
+        max_overflow=10,
+        pool_timeout=30,
+        # No per-checkout ping: Neon drops connections idle for ~5 minutes,
+        # so recycle them before that instead of testing each one
+        pool_pre_ping=False,
+        pool_recycle=240,
+        connect_args={"prepare_threshold": None} if DATABASE_PGBOUNCER else {},
+    )
+    if DATABASE_URL
+    else None
+)
+
+
+def get_engine() -> AsyncEngine:
+    """Get the shared async database engine."""
+    if engine is None:
+        raise RuntimeError("DATABASE_URL environment variable is required.")
+    return engine
+
+
+async def warm_pool() -> None:
+    """Open the pool's connections up front so early requests don't each pay for a connect."""
+    if engine is None:
+        return
+    # Held together so the pool has to open POOL_SIZE distinct connections
+    results = await asyncio.gather(*(engine.connect().start() for _ in range(POOL_SIZE)), return_exceptions=True)
+    await asyncio.gather(*(conn.close() for conn in results if not isinstance(conn, BaseException)))
+    errors = [e for e in results if isinstance(e, BaseException)]
+    if errors:
+        raise errors[0]
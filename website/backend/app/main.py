@@ -7,23 +7,44 @@ pulling live rows from the `real_estate_data` table hosted on Neon.
 
 from __future__ import annotations
 
+import asyncio
+import logging
 import os
+import queue
+import re
+from contextlib import asynccontextmanager, suppress
 from functools import lru_cache
-from typing import List, Sequence
+from logging.handlers import QueueHandler, QueueListener
+from typing import AsyncIterator, Iterable, List, Sequence
 
+import numpy as np
+from numpy.typing import ArrayLike
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, Query, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from sqlalchemy import create_engine, text
-from sqlalchemy.engine import Engine
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, TypeAdapter
+from sqlalchemy import Row, RowMapping, text
+from sqlalchemy.ext.asyncio import AsyncConnection
+from sqlalchemy.sql.elements import TextClause
 import httpx
 
 from app.routers import auth, user
 from app.auth import get_current_user
+from app.cache import LISTINGS_FALLBACK_CACHE, PREFERENCES_CACHE, TTLCache, cached
+from app.database import engine, get_engine, warm_pool
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# While the app is serving, its loggers (the "app" package) only enqueue records and a
+# listener thread writes them to stderr; attached in lifespan, so importing has no effect
+LOG_QUEUE: queue.SimpleQueue = queue.SimpleQueue()
+LOG_QUEUE_HANDLER = QueueHandler(LOG_QUEUE)
+LOG_LISTENER = QueueListener(LOG_QUEUE, logging.StreamHandler(), respect_handler_level=True)
+
 
 class Listing(BaseModel):
   """Simplified payload consumed by the frontend listings grid."""
@@ -40,10 +61,38 @@ class Listing(BaseModel):
   image: str
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+  logging.getLogger("app").addHandler(LOG_QUEUE_HANDLER)
+  LOG_LISTENER.start()
+  try:
+    await warm_pool()
+  except Exception as e:
+    # Not fatal: requests open connections on demand as before
+    logger.warning("Could not pre-warm the database pool: %s", e)
+  view_flusher = asyncio.create_task(user.flush_views_forever())
+  yield
+  view_flusher.cancel()
+  with suppress(asyncio.CancelledError):
+    await view_flusher
+  try:
+    await user.flush_views()
+  except Exception as e:
+    logger.error("Error logging property views on shutdown: %s", e, exc_info=True)
+  await PLACES_CLIENT.aclose()
+  await auth.OAUTH_CLIENT.aclose()
+  if engine is not None:
+    await engine.dispose()
+  LOG_LISTENER.stop()
+  logging.getLogger("app").removeHandler(LOG_QUEUE_HANDLER)
+
+
 app = FastAPI(
   title="SmartLivingAdvisor API",
   description="FastAPI backend powering the SmartLivingAdvisor experience.",
   version="0.2.0",
+  lifespan=lifespan,
+  default_response_class=ORJSONResponse,
 )
 
 # CORS configuration - explicitly allow Vite dev server and production origins
@@ -68,58 +117,65 @@ app.add_middleware(
   expose_headers=["*"],
 )
 
+# Listing/search JSON compresses well; skip tiny bodies and keep the level latency-friendly
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 # Register routers
 app.include_router(auth.router)
 app.include_router(user.router)
 
 
-def get_engine() -> Engine:
-  """Create (and cache) the SQLAlchemy engine."""
-
-  @lru_cache(maxsize=1)
-  def _create_engine() -> Engine:
-    database_url = os.getenv("DATABASE_URL")
-    if not database_url:
-      raise RuntimeError("DATABASE_URL environment variable is required to query Neon data.")
-    return create_engine(database_url, pool_pre_ping=True)
-
-  return _create_engine()
-
-
-LISTING_IMAGES = [
+LISTING_IMAGES = (
   "/assets/property_type/Gemini_Generated_Image_eplvsbeplvsbeplv.png",
   "/assets/property_type/Gemini_Generated_Image_fk2om1fk2om1fk2o.png",
   "/assets/property_type/Gemini_Generated_Image_hozu90hozu90hozu.png",
   "/assets/property_type/Gemini_Generated_Image_ksqnxhksqnxhksqn.png",
   "/assets/property_type/Gemini_Generated_Image_r7jqkkr7jqkkr7jq.png",
   "/assets/property_type/Gemini_Generated_Image_x9pl10x9pl10x9pl.png",
-]
+)
 
 
+# Images are assigned round-robin by rank inside the query
+LISTING_IMAGES_SQL = "ARRAY[{}]".format(", ".join(f"'{image}'" for image in LISTING_IMAGES))
+
 LISTING_QUERY = """
 SELECT
-  no,
-  property_type,
-  price,
-  location,
-  COALESCE(floor_area_m2, floor_area) AS floor_area_m2,
-  num_rooms,
-  num_bathrooms,
-  smart_living_score
-FROM public.real_estate_data
-WHERE price IS NOT NULL
-  AND location IS NOT NULL
-  {city_clause}
+  ranked.*,
+  ({images})[(row_number() OVER (ORDER BY smart_living_score DESC NULLS LAST, price ASC) - 1) % {image_count} + 1] AS image
+FROM (
+  SELECT
+    no,
+    title,
+    price_label,
+    location_label,
+    area_label,
+    rooms_label,
+    score_label,
+    badge_label,
+    badge_color,
+    smart_living_score,
+    price
+  FROM public.real_estate_listings_display
+  WHERE true
+    {{city_clause}}
+  ORDER BY smart_living_score DESC NULLS LAST, price ASC
+  LIMIT :limit
+) AS ranked
 ORDER BY smart_living_score DESC NULLS LAST, price ASC
-LIMIT :limit
-"""
+""".format(images=LISTING_IMAGES_SQL, image_count=len(LISTING_IMAGES))
+
+# Keyed by whether a city filter was supplied
+LISTING_STMTS = {
+  False: text(LISTING_QUERY.format(city_clause="")),
+  True: text(LISTING_QUERY.format(city_clause="AND city_normalized = :city")),
+}
 
 SEARCH_QUERY = """
 SELECT
   no,
   property_type,
   price,
-  location,
+  COALESCE(NULLIF(location, ''), 'Unknown') AS location,
   latitude,
   longitude,
   COALESCE(floor_area_m2, floor_area) AS floor_area_m2,
@@ -130,57 +186,54 @@ FROM public.real_estate_data
 WHERE price IS NOT NULL
   AND location IS NOT NULL
   {search_clause}
-ORDER BY smart_living_score DESC NULLS LAST, price ASC
+ORDER BY {order_by}
 LIMIT :limit
 """
 
 
-def _format_price(price: float | int | None) -> str:
-  if price is None:
-    return "Price on request"
-  return f"${price:,.0f}"
+# Pages at least this large are read through a server-side cursor in batches
+STREAM_RESULTS_MIN_ROWS = 100
+STREAM_BATCH_SIZE = 50
 
 
-def _format_area(area_m2: float | None) -> str:
-  if not area_m2:
-    return "—"
-  sqft = area_m2 * 10.7639
-  return f"{sqft:,.0f} sq ft"
+async def _iter_rows(conn: AsyncConnection, stmt: TextClause, params: dict, limit: int) -> AsyncIterator[Row]:
+  """Execute ``stmt`` and yield its rows, streaming them when the requested page is large."""
+  if limit >= STREAM_RESULTS_MIN_ROWS:
+    result = await conn.stream(stmt.execution_options(yield_per=STREAM_BATCH_SIZE), params)
+    async for row in result:
+      yield row
+  else:
+    for row in await conn.execute(stmt, params):
+      yield row
 
 
-def _format_rooms(num_rooms: int | None, num_bathrooms: int | None) -> str:
-  beds = f"{int(num_rooms)} Bed" if num_rooms is not None else "Beds N/A"
-  baths = f"{int(num_bathrooms)} Bath" if num_bathrooms is not None else "Bath N/A"
-  return f"{beds} • {baths}"
+def _contains_pattern(value: str) -> str:
+  """Case-insensitive substring pattern for ``LOWER(column) LIKE``, with user wildcards escaped."""
+  escaped = value.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+  return f"%{escaped}%"
 
 
-def _badge_for_score(score: float | None) -> tuple[str, str]:
-  if score is None:
-    return "New Listing", "#F4A340"
-  if score >= 90:
-    return "Excellent Match", "#52D1C6"
-  if score >= 85:
-    return "High Score", "#2D9CDB"
-  return "New Listing", "#EF6C48"
+def _prefix_tsquery(value: str) -> str:
+  """Turn free text into a tsquery matching every word as a prefix ("aus tx" -> "aus:* & tx:*")."""
+  return " & ".join(f"{word}:*" for word in re.findall(r"\w+", value.lower()))
 
 
-def _rows_to_listings(rows: Sequence[dict], limit: int) -> List[Listing]:
+def _rows_to_listings(rows: Iterable[RowMapping], limit: int) -> List[Listing]:
   listings: List[Listing] = []
-  for idx, row in enumerate(rows):
-    score_value = row.get("smart_living_score")
-    badge_label, badge_color = _badge_for_score(score_value)
+  for row in rows:
+    # Labels are formatted by the real_estate_listings_display view, so validation is skipped
     listings.append(
-      Listing(
+      Listing.model_construct(
         id=int(row["no"]),
-        title=(row.get("property_type") or "Smart Home").title(),
-        price=_format_price(row.get("price")),
-        location=str(row.get("location") or "Unknown"),
-        area=_format_area(row.get("floor_area_m2")),
-        rooms=_format_rooms(row.get("num_rooms"), row.get("num_bathrooms")),
-        score=f"{int(score_value):d} Smart Score" if score_value is not None else "Smart score coming soon",
-        badge=badge_label,
-        badge_color=badge_color,
-        image=LISTING_IMAGES[idx % len(LISTING_IMAGES)],
+        title=row["title"],
+        price=row["price_label"],
+        location=row["location_label"],
+        area=row["area_label"],
+        rooms=row["rooms_label"],
+        score=row["score_label"],
+        badge=row["badge_label"],
+        badge_color=row["badge_color"],
+        image=row["image"],
       )
     )
   # If Neon returned fewer than requested, still ensure we fill at least one listing
@@ -209,32 +262,53 @@ def healthcheck() -> dict[str, str]:
   return {"status": "ok", "service": "smartlivingadvisor-api"}
 
 
+# Slow queries give up after this long when a previous response can be served instead
+LISTINGS_FALLBACK_TIMEOUT = 0.5
+
+
+@cached(TTLCache(ttl=60, maxsize=256))
+async def _fetch_listings(city: str | None, limit: int) -> List[Listing]:
+  engine = get_engine()
+  stmt = LISTING_STMTS[bool(city)]
+
+  params: dict[str, object] = {"limit": limit}
+  if city:
+    params["city"] = city
+
+  async with engine.connect() as conn:
+    listings = _rows_to_listings((await conn.execute(stmt, params)).mappings(), limit)
+
+  # Stored here rather than by the caller so a query that outlives the
+  # timeout (it is shielded from cancellation) still refreshes the fallback
+  LISTINGS_FALLBACK_CACHE.set((city, limit), listings)
+  return listings
+
+
 @app.get("/listings", response_model=List[Listing], tags=["listings"])
-def list_listings(
-  city: str | None = Query(default=None, description="Filter by city or neighborhood"),
+async def list_listings(
+  city: str | None = Query(default=None, description="Filter by city"),
   limit: int = Query(default=6, ge=1, le=24),
 ) -> List[Listing]:
   """Return featured listings fetched directly from Neon."""
 
+  # Normalized once so the query, its cache and the fallback all share one key
+  city = city.strip().lower() if city else None
+  fallback = LISTINGS_FALLBACK_CACHE.get((city, limit))
   try:
-    engine = get_engine()
-    city_clause = "AND LOWER(location) LIKE :city_pattern" if city else ""
-    stmt = text(LISTING_QUERY.format(city_clause=city_clause))
-
-    params: dict[str, object] = {"limit": limit}
-    if city:
-      params["city_pattern"] = f"%{city.lower()}%"
-
-    with engine.connect() as conn:
-      rows = conn.execute(stmt, params).mappings().all()
-
-    return _rows_to_listings(rows, limit)
+    if fallback is None:
+      return await _fetch_listings(city, limit)
+    fetch = asyncio.ensure_future(_fetch_listings(city, limit))
+    # Retrieve the outcome so a query failing after the timeout isn't logged as unhandled
+    fetch.add_done_callback(lambda t: t.cancelled() or t.exception())
+    return await asyncio.wait_for(asyncio.shield(fetch), timeout=LISTINGS_FALLBACK_TIMEOUT)
+  except asyncio.TimeoutError:
+    # Fresh results are cached by _fetch_listings; the stale fallback never is
+    return fallback
   except Exception as e:
-    # Log error but still return empty/fallback listings so CORS headers are sent
-    import logging
-    logging.error(f"Error fetching listings: {e}", exc_info=True)
-    # Return empty list rather than raising to ensure CORS headers are sent
-    return []
+    # Log error but still return the last good/empty listings so CORS headers are sent
+    logger.error("Error fetching listings: %s", e, exc_info=True)
+    # Return the previous response (or an empty list) rather than raising to ensure CORS headers are sent
+    return fallback or []
 
 
 class SearchProperty(BaseModel):
@@ -260,8 +334,77 @@ class PropertyDetail(SearchProperty):
   address: str | None = None
 
 
+# (search_properties argument, condition); each condition binds a parameter of the same name
+SEARCH_FILTERS = (
+  # search_tsv is maintained by Scripts/Database/migrate_query_performance.py
+  ("search_tsquery", "search_tsv @@ to_tsquery('simple', :search_tsquery)"),
+  ("property_type", "LOWER(property_type) = :property_type"),
+  ("min_price", "price >= :min_price"),
+  ("max_price", "price <= :max_price"),
+  ("min_beds", "num_rooms >= :min_beds"),
+  ("min_baths", "num_bathrooms >= :min_baths"),
+  ("has_gym", "has_gym = :has_gym"),
+  ("has_parking", "has_parking = :has_parking"),
+  ("has_pool", "has_pool = :has_pool"),
+  ("min_score", "smart_living_score >= :min_score"),
+  ("max_score", "smart_living_score <= :max_score"),
+  ("smart_label", "LOWER(smart_label) = :smart_label"),
+  ("amenities_contains", "LOWER(amenities) LIKE :amenities_contains"),
+  ("air_conditioning", "air_conditioning = :air_conditioning"),
+  ("heating", "heating = :heating"),
+  ("min_dist_hospital", "dist_hospital >= :min_dist_hospital"),
+  ("max_dist_hospital", "dist_hospital <= :max_dist_hospital"),
+  ("min_dist_school", "dist_school >= :min_dist_school"),
+  ("max_dist_school", "dist_school <= :max_dist_school"),
+  ("min_dist_bus", "dist_bus >= :min_dist_bus"),
+  ("max_dist_bus", "dist_bus <= :max_dist_bus"),
+  ("min_crime_rate", "crime_rate >= :min_crime_rate"),
+  ("max_crime_rate", "crime_rate <= :max_crime_rate"),
+  ("min_transport_score", "transport_score >= :min_transport_score"),
+  ("max_transport_score", "transport_score <= :max_transport_score"),
+  ("min_population", "population >= :min_population"),
+  ("max_population", "population <= :max_population"),
+  ("min_income", "income >= :min_income"),
+  ("max_income", "income <= :max_income"),
+  ("min_price_to_income", "price_to_income_ratio >= :min_price_to_income"),
+  ("max_price_to_income", "price_to_income_ratio <= :max_price_to_income"),
+  ("hqs_pass_only", "_hqs_pass_boolean = :hqs_pass_only"),
+  ("min_hqs_score", "hqs_score >= :min_hqs_score"),
+  ("max_hqs_score", "hqs_score <= :max_hqs_score"),
+)
+
+
+SEARCH_ORDER = {
+  "score": "smart_living_score DESC NULLS LAST, price ASC",
+  "price_asc": "price ASC",
+  "price_desc": "price DESC",
+}
+
+# The no-filter statement for each sort order, compiled up front
+SEARCH_STMTS = {
+  sort_by: text(SEARCH_QUERY.format(search_clause="", order_by=order_by))
+  for sort_by, order_by in SEARCH_ORDER.items()
+}
+
+
+@lru_cache(maxsize=512)
+def _search_statement(mask: int, sort_by: str) -> TextClause:
+  """Compile the search query for a set of supplied filters (bit i = SEARCH_FILTERS[i])."""
+
+  if not mask:
+    return SEARCH_STMTS[sort_by]
+
+  search_clause = "\n  ".join(
+    f"AND {condition}"
+    for bit, (_, condition) in enumerate(SEARCH_FILTERS)
+    if mask & (1 << bit)
+  )
+  return text(SEARCH_QUERY.format(search_clause=search_clause, order_by=SEARCH_ORDER[sort_by]))
+
+
 @app.get("/search", response_model=List[SearchProperty], tags=["search"])
-def search_properties(
+@cached(TTLCache(ttl=30, maxsize=1024))
+async def search_properties(
   query: str = Query(default="", description="Search query for location, city, or neighborhood"),
   property_type: str | None = Query(default=None, description="Filter by property type"),
   min_price: int | None = Query(default=None, ge=0, description="Minimum price"),
@@ -301,233 +444,80 @@ def search_properties(
 ) -> List[SearchProperty]:
   """Search properties with filters. Returns results with coordinates for map display."""
 
+  filter_values = dict(locals())
   try:
     engine = get_engine()
     
-    # Build WHERE clause
-    conditions = ["price IS NOT NULL", "location IS NOT NULL"]
-    params: dict[str, object] = {"limit": limit}
-    
-    if query:
-      conditions.append("(LOWER(location) LIKE :search_pattern OR LOWER(property_type) LIKE :search_pattern)")
-      params["search_pattern"] = f"%{query.lower()}%"
-    
-    if property_type:
-      conditions.append("LOWER(property_type) = :property_type")
-      params["property_type"] = property_type.lower()
-    
-    if min_price is not None:
-      conditions.append("price >= :min_price")
-      params["min_price"] = min_price
-    
-    if max_price is not None:
-      conditions.append("price <= :max_price")
-      params["max_price"] = max_price
-    
-    if min_beds is not None:
-      conditions.append("num_rooms >= :min_beds")
-      params["min_beds"] = min_beds
-    
-    if min_baths is not None:
-      conditions.append("num_bathrooms >= :min_baths")
-      params["min_baths"] = min_baths
-    
-    if has_gym is not None:
-      conditions.append("has_gym = :has_gym")
-      params["has_gym"] = has_gym
-    
-    if has_parking is not None:
-      conditions.append("has_parking = :has_parking")
-      params["has_parking"] = has_parking
-    
-    if has_pool is not None:
-      conditions.append("has_pool = :has_pool")
-      params["has_pool"] = has_pool
-    
-    if min_score is not None:
-      conditions.append("smart_living_score >= :min_score")
-      params["min_score"] = min_score
-    
-    if max_score is not None:
-      conditions.append("smart_living_score <= :max_score")
-      params["max_score"] = max_score
-    
-    if smart_label:
-      conditions.append("LOWER(smart_label) = :smart_label")
-      params["smart_label"] = smart_label.lower()
-    
-    if amenities_contains:
-      conditions.append("LOWER(amenities) LIKE :amenities_contains")
-      params["amenities_contains"] = f"%{amenities_contains.lower()}%"
-    
-    if air_conditioning is not None:
-      conditions.append("air_conditioning = :air_conditioning")
-      params["air_conditioning"] = air_conditioning
-    
-    if heating is not None:
-      conditions.append("heating = :heating")
-      params["heating"] = heating
-    
-    if min_dist_hospital is not None:
-      conditions.append("dist_hospital >= :min_dist_hospital")
-      params["min_dist_hospital"] = min_dist_hospital
-    
-    if max_dist_hospital is not None:
-      conditions.append("dist_hospital <= :max_dist_hospital")
-      params["max_dist_hospital"] = max_dist_hospital
-    
-    if min_dist_school is not None:
-      conditions.append("dist_school >= :min_dist_school")
-      params["min_dist_school"] = min_dist_school
-    
-    if max_dist_school is not None:
-      conditions.append("dist_school <= :max_dist_school")
-      params["max_dist_school"] = max_dist_school
-    
-    if min_dist_bus is not None:
-      conditions.append("dist_bus >= :min_dist_bus")
-      params["min_dist_bus"] = min_dist_bus
-    
-    if max_dist_bus is not None:
-      conditions.append("dist_bus <= :max_dist_bus")
-      params["max_dist_bus"] = max_dist_bus
-    
-    if min_crime_rate is not None:
-      conditions.append("crime_rate >= :min_crime_rate")
-      params["min_crime_rate"] = min_crime_rate
-    
-    if max_crime_rate is not None:
-      conditions.append("crime_rate <= :max_crime_rate")
-      params["max_crime_rate"] = max_crime_rate
-    
-    if min_transport_score is not None:
-      conditions.append("transport_score >= :min_transport_score")
-      params["min_transport_score"] = min_transport_score
-    
-    if max_transport_score is not None:
-      conditions.append("transport_score <= :max_transport_score")
-      params["max_transport_score"] = max_transport_score
-    
-    if min_population is not None:
-      conditions.append("population >= :min_population")
-      params["min_population"] = min_population
+    # Filters that need normalizing before they're bound; the rest bind as given
+    filter_values["search_tsquery"] = _prefix_tsquery(query) or None
+    filter_values["property_type"] = property_type.lower() if property_type else None
+    filter_values["smart_label"] = smart_label.lower() if smart_label else None
+    filter_values["amenities_contains"] = _contains_pattern(amenities_contains) if amenities_contains else None
     
-    if max_population is not None:
-      conditions.append("population <= :max_population")
-      params["max_population"] = max_population
-    
-    if min_income is not None:
-      conditions.append("income >= :min_income")
-      params["min_income"] = min_income
-    
-    if max_income is not None:
-      conditions.append("income <= :max_income")
-      params["max_income"] = max_income
-    
-    if min_price_to_income is not None:
-      conditions.append("price_to_income_ratio >= :min_price_to_income")
-      params["min_price_to_income"] = min_price_to_income
-    
-    if max_price_to_income is not None:
-      conditions.append("price_to_income_ratio <= :max_price_to_income")
-      params["max_price_to_income"] = max_price_to_income
-    
-    if hqs_pass_only is not None:
-      conditions.append("_hqs_pass_boolean = :hqs_pass_only")
-      params["hqs_pass_only"] = hqs_pass_only
-    
-    if min_hqs_score is not None:
-      conditions.append("hqs_score >= :min_hqs_score")
-      params["min_hqs_score"] = min_hqs_score
-    
-    if max_hqs_score is not None:
-      conditions.append("hqs_score <= :max_hqs_score")
-      params["max_hqs_score"] = max_hqs_score
-    
-    where_clause = " AND ".join(conditions)
-    
-    # Build ORDER BY clause
-    if sort_by == "price_asc":
-      order_by = "price ASC"
-    elif sort_by == "price_desc":
-      order_by = "price DESC"
-    else:  # default: score
-      order_by = "smart_living_score DESC NULLS LAST, price ASC"
-    
-    query_sql = f"""
-    SELECT
-      no,
-      property_type,
-      price,
-      location,
-      latitude,
-      longitude,
-      COALESCE(floor_area_m2, floor_area) AS floor_area_m2,
-      num_rooms,
-      num_bathrooms,
-      smart_living_score
-    FROM public.real_estate_data
-    WHERE {where_clause}
-    ORDER BY {order_by}
-    LIMIT :limit
-    """
+    mask = 0
+    params: dict[str, object] = {"limit": limit}
+    for bit, (name, _) in enumerate(SEARCH_FILTERS):
+      value = filter_values[name]
+      if value is not None:
+        mask |= 1 << bit
+        params[name] = value
     
-    stmt = text(query_sql)
-
-    with engine.connect() as conn:
-      rows = conn.execute(stmt, params).mappings().all()
-
-    results: List[SearchProperty] = []
-    for row in rows:
-      results.append(
-        SearchProperty(
-          no=int(row["no"]),
-          property_type=row.get("property_type"),
-          price=row.get("price"),
-          location=str(row.get("location") or "Unknown"),
-          latitude=float(row["latitude"]) if row.get("latitude") is not None else None,
-          longitude=float(row["longitude"]) if row.get("longitude") is not None else None,
-          num_rooms=row.get("num_rooms"),
-          num_bathrooms=row.get("num_bathrooms"),
-          floor_area_m2=float(row["floor_area_m2"]) if row.get("floor_area_m2") is not None else None,
-          smart_living_score=float(row["smart_living_score"]) if row.get("smart_living_score") is not None else None,
-        )
-      )
+    # Unknown sort options fall back to score, as before
+    stmt = _search_statement(mask, sort_by if sort_by in SEARCH_ORDER else "score")
+
+    async with engine.connect() as conn:
+      rows = [row._mapping async for row in _iter_rows(conn, stmt, params, limit)]
 
-    return results
+    return _rows_to_search_properties(rows)
   except Exception as e:
-    import logging
-    logging.error(f"Error searching properties: {e}", exc_info=True)
+    logger.error("Error searching properties: %s", e, exc_info=True)
     return []
 
 
+# Validates a whole page in one pydantic-core call instead of one constructor call per row
+SEARCH_PROPERTIES_ADAPTER = TypeAdapter(List[SearchProperty])
+
+
+def _rows_to_search_properties(rows: Sequence[RowMapping]) -> List[SearchProperty]:
+  """Build search/recommendation payloads from rows whose columns are named like SearchProperty's fields.
+
+  The queries already COALESCE a missing location to "Unknown".
+  """
+
+  return SEARCH_PROPERTIES_ADAPTER.validate_python(rows)
+
+
+# Built once so SQLAlchemy's compiled cache hits on every call; psycopg then
+# prepares it server-side once a connection has run it a few times
+GET_PROPERTY_STMT = text("""
+  SELECT
+    no,
+    property_type,
+    price,
+    location,
+    latitude,
+    longitude,
+    COALESCE(floor_area_m2, floor_area) AS floor_area_m2,
+    num_rooms,
+    num_bathrooms,
+    smart_living_score,
+    amenities
+  FROM public.real_estate_data
+  WHERE no = :property_id
+  LIMIT 1
+""")
+
+
 @app.get("/property/{property_id}", response_model=PropertyDetail, tags=["properties"])
-def get_property(property_id: int) -> PropertyDetail:
+@cached(TTLCache(ttl=300, maxsize=2048))
+async def get_property(property_id: int) -> PropertyDetail:
   """Return a single property by its listing number."""
 
   try:
     engine = get_engine()
 
-    query_sql = """
-    SELECT
-      no,
-      property_type,
-      price,
-      location,
-      latitude,
-      longitude,
-      COALESCE(floor_area_m2, floor_area) AS floor_area_m2,
-      num_rooms,
-      num_bathrooms,
-      smart_living_score,
-      amenities
-    FROM public.real_estate_data
-    WHERE no = :property_id
-    LIMIT 1
-    """
-
-    with engine.connect() as conn:
-      row = conn.execute(text(query_sql), {"property_id": property_id}).mappings().first()
+    async with engine.connect() as conn:
+      row = (await conn.execute(GET_PROPERTY_STMT, {"property_id": property_id})).mappings().first()
 
     if not row:
       raise HTTPException(status_code=404, detail="Property not found")
@@ -542,7 +532,7 @@ def get_property(property_id: int) -> PropertyDetail:
 
     # Generate images array based on property type
     property_type = row.get("property_type") or ""
-    images = LISTING_IMAGES.copy()  # Use all available images for the gallery
+    images = LISTING_IMAGES  # Use all available images for the gallery
 
     return PropertyDetail(
       no=int(row["no"]),
@@ -564,138 +554,118 @@ def get_property(property_id: int) -> PropertyDetail:
   except HTTPException:
     raise
   except Exception as e:
-    import logging
-    logging.error(f"Error loading property {property_id}: {e}", exc_info=True)
+    logger.error("Error loading property %s: %s", property_id, e, exc_info=True)
     raise HTTPException(status_code=500, detail="Unable to load property")
 
 
-@app.get("/api/properties/{id}", response_model=PropertyDetail, tags=["properties"])
-def get_property_by_id(id: int) -> PropertyDetail:
-  """Return a single property by its listing number (API endpoint for frontend)."""
-  # Delegate to the main property endpoint
-  return get_property(id)
+# The embedding (price, rooms, baths, area, score, coordinates, property type)
+# is maintained by Scripts/Database/migrate_query_performance.py
+# One round trip: the target's embedding and its nearest neighbours. No row
+# means the property doesn't exist; a single all-NULL row means it has no
+# embedding yet.
+SIMILAR_STMT = text("""
+  WITH target AS (
+    SELECT embedding
+    FROM real_estate_data
+    WHERE no = :property_id
+  )
+  SELECT
+    neighbour.no,
+    neighbour.property_type,
+    neighbour.price,
+    neighbour.location,
+    neighbour.latitude,
+    neighbour.longitude,
+    neighbour.num_rooms,
+    neighbour.num_bathrooms,
+    neighbour.floor_area_m2,
+    neighbour.smart_living_score
+  FROM target
+  LEFT JOIN LATERAL (
+    SELECT
+      no,
+      property_type,
+      price,
+      COALESCE(NULLIF(location, ''), 'Unknown') AS location,
+      latitude,
+      longitude,
+      num_rooms,
+      num_bathrooms,
+      COALESCE(floor_area_m2, floor_area) AS floor_area_m2,
+      smart_living_score,
+      embedding
+    FROM real_estate_data
+    WHERE target.embedding IS NOT NULL
+      AND no != :property_id
+      AND price IS NOT NULL
+      AND location IS NOT NULL
+    ORDER BY embedding <-> target.embedding
+    LIMIT :limit
+  ) AS neighbour ON true
+  ORDER BY neighbour.embedding <-> target.embedding
+""")
 
 
 @app.get("/api/properties/similar", response_model=List[SearchProperty], tags=["properties"])
-def get_similar_properties(
+@cached(TTLCache(ttl=60, maxsize=1024))
+async def get_similar_properties(
   property_id: int = Query(..., alias="id", description="Property ID to find similar properties for"),
   limit: int = Query(default=6, ge=1, le=20, description="Number of similar properties to return")
 ) -> List[SearchProperty]:
-  """Find similar properties based on price, location, and property type."""
+  """Find similar properties by nearest neighbours on the precomputed feature embedding."""
   try:
     engine = get_engine()
     
-    # First, get the target property
-    target_query = text("""
-      SELECT price, property_type, latitude, longitude, num_rooms, num_bathrooms, smart_living_score
-      FROM real_estate_data
-      WHERE no = :property_id
-    """)
-    
-    with engine.connect() as conn:
-      target = conn.execute(target_query, {"property_id": property_id}).mappings().first()
-      
-      if not target:
-        raise HTTPException(status_code=404, detail="Property not found")
-      
-      target_price = float(target["price"]) if target.get("price") else None
-      target_type = target.get("property_type")
-      target_lat = float(target["latitude"]) if target.get("latitude") else None
-      target_lng = float(target["longitude"]) if target.get("longitude") else None
-      
-      # Build similarity query
-      conditions = ["no != :property_id"]
-      params = {"property_id": property_id, "limit": limit + 1}  # +1 to exclude the target
-      
-      # Similar property type
-      if target_type:
-        conditions.append("property_type = :property_type")
-        params["property_type"] = target_type
-      
-      # Similar price range (±30%)
-      if target_price:
-        conditions.append("price BETWEEN :min_price AND :max_price")
-        params["min_price"] = target_price * 0.7
-        params["max_price"] = target_price * 1.3
-      
-      # Similar location (within 10km if coordinates available)
-      if target_lat and target_lng:
-        conditions.append("""
-          (6371 * acos(
-            cos(radians(:target_lat)) * cos(radians(latitude)) *
-            cos(radians(longitude) - radians(:target_lng)) +
-            sin(radians(:target_lat)) * sin(radians(latitude))
-          )) <= 10
-        """)
-        params["target_lat"] = target_lat
-        params["target_lng"] = target_lng
-      
-      where_clause = " AND ".join(conditions)
-      
-      # Build safe query
-      if not conditions:
-        conditions = ["no != :property_id"]
-      
-      where_clause = " AND ".join(conditions)
-      
-      # Use COALESCE for floor_area_m2
-      similar_query = text(f"""
-        SELECT
-          no,
-          property_type,
-          price,
-          location,
-          latitude,
-          longitude,
-          num_rooms,
-          num_bathrooms,
-          COALESCE(floor_area_m2, floor_area) AS floor_area_m2,
-          smart_living_score
-        FROM real_estate_data
-        WHERE {where_clause}
-          AND price IS NOT NULL
-          AND location IS NOT NULL
-        ORDER BY 
-          CASE WHEN property_type = :property_type THEN 0 ELSE 1 END,
-          ABS(COALESCE(price, 0) - :target_price) ASC,
-          COALESCE(smart_living_score, 0) DESC
-        LIMIT :limit
-      """)
-      
-      params["target_price"] = target_price or 0
-      if "property_type" not in params:
-        params["property_type"] = target_type or ""
-      
-      results = conn.execute(similar_query, params).mappings().all()
+    async with engine.connect() as conn:
+      params = {"property_id": property_id, "limit": limit}
+      rows = [row async for row in _iter_rows(conn, SIMILAR_STMT, params, limit)]
     
-    similar_properties: List[SearchProperty] = []
-    for row in results:
-      similar_properties.append(
-        SearchProperty(
-          no=int(row["no"]),
-          property_type=row.get("property_type"),
-          price=row.get("price"),
-          location=str(row.get("location") or "Unknown"),
-          latitude=float(row["latitude"]) if row.get("latitude") is not None else None,
-          longitude=float(row["longitude"]) if row.get("longitude") is not None else None,
-          num_rooms=row.get("num_rooms"),
-          num_bathrooms=row.get("num_bathrooms"),
-          floor_area_m2=float(row["floor_area_m2"]) if row.get("floor_area_m2") is not None else None,
-          smart_living_score=float(row["smart_living_score"]) if row.get("smart_living_score") is not None else None,
-        )
-      )
+    if not rows:
+      raise HTTPException(status_code=404, detail="Property not found")
     
-    return similar_properties[:limit]
+    # The NULL row of a listing added after the embeddings were last built is dropped here
+    return _rows_to_search_properties([row._mapping for row in rows if row.no is not None])
     
   except HTTPException:
     raise
   except Exception as e:
-    import logging
-    logging.error(f"Error finding similar properties: {e}", exc_info=True)
+    logger.error("Error finding similar properties: %s", e, exc_info=True)
     return []
 
 
+@app.get("/api/properties/{id}", response_model=PropertyDetail, tags=["properties"])
+async def get_property_by_id(id: int) -> PropertyDetail:
+  """Return a single property by its listing number (API endpoint for frontend)."""
+  # Delegate to the main property endpoint, passing the id by keyword as FastAPI
+  # does so both routes share one cache entry per property
+  return await get_property(property_id=id)
+
+
+EARTH_RADIUS_KM = 6371.0
+
+# Reused across requests so Places lookups share pooled keep-alive (HTTP/2) connections
+PLACES_CLIENT = httpx.AsyncClient(
+  base_url="https://maps.googleapis.com",
+  http2=True,
+  timeout=10.0,
+  limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+)
+
+
+def _haversine_km(lat1: ArrayLike, lng1: ArrayLike, lat2: ArrayLike, lng2: ArrayLike) -> np.ndarray:
+  """Elementwise great-circle distances in km between broadcastable coordinates in degrees.
+
+  A scalar origin against point arrays gives one-to-many distances;
+  ``lats[:, None]`` against ``poi_lats[None, :]`` gives a full distance matrix.
+  """
+  lat1, lng1, lat2, lng2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lng1, lat2, lng2))
+  a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+  return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
 @app.get("/api/places/nearby", tags=["places"])
+# Only successful lookups are kept so a missing key or quota error isn't pinned for 10 minutes
+@cached(TTLCache(ttl=600, maxsize=1024), cache_if=lambda response: response.get("status") == "OK")
 async def get_nearby_places(
   lat: float = Query(..., description="Latitude"),
   lng: float = Query(..., description="Longitude"),
@@ -716,51 +686,96 @@ async def get_nearby_places(
     # Use first type for the API call (Google Places API only accepts one type per request)
     primary_type = type_list[0]
     
-    url = f"https://maps.googleapis.com/maps/api/place/nearbysearch/json?location={lat},{lng}&radius={radius}&type={primary_type}&key={google_api_key}"
-    
-    async with httpx.AsyncClient() as client:
-      response = await client.get(url, timeout=10.0)
-      response.raise_for_status()
-      data = response.json()
-      
-      if data.get("status") not in ["OK", "ZERO_RESULTS"]:
-        return {"results": [], "status": data.get("status", "ERROR")}
-      
-      # Format results with geometry for distance calculations
-      results = []
-      for place in data.get("results", [])[:20]:
-        geometry = place.get("geometry", {})
-        location = geometry.get("location", {})
-        if not location:
-          continue
-          
-        results.append({
-          "name": place.get("name", "Unknown"),
-          "rating": place.get("rating"),
-          "vicinity": place.get("vicinity"),
-          "formatted_address": place.get("formatted_address"),
-          "types": place.get("types", []),
-          "geometry": {
-            "location": {
-              "lat": location.get("lat"),
-              "lng": location.get("lng")
-            }
-          },
-          "opening_hours": place.get("opening_hours", {})
-        })
-      
-      return {"results": results, "status": "OK"}
+    params = {
+      "location": f"{lat},{lng}",
+      "radius": radius,
+      "type": primary_type,
+      "key": google_api_key,
+    }
+    response = await PLACES_CLIENT.get("/maps/api/place/nearbysearch/json", params=params)
+    response.raise_for_status()
+    data = response.json()
+    
+    if data.get("status") not in ["OK", "ZERO_RESULTS"]:
+      return {"results": [], "status": data.get("status", "ERROR")}
+    
+    # Format results with geometry for distance calculations
+    results = []
+    for place in data.get("results", [])[:20]:
+      geometry = place.get("geometry", {})
+      location = geometry.get("location", {})
+      if not location or location.get("lat") is None or location.get("lng") is None:
+        continue
+        
+      results.append({
+        "name": place.get("name", "Unknown"),
+        "rating": place.get("rating"),
+        "vicinity": place.get("vicinity"),
+        "formatted_address": place.get("formatted_address"),
+        "types": place.get("types", []),
+        "geometry": {
+          "location": {
+            "lat": location.get("lat"),
+            "lng": location.get("lng")
+          }
+        },
+        "opening_hours": place.get("opening_hours", {})
+      })
+    
+    if results:
+      lats = np.fromiter((r["geometry"]["location"]["lat"] for r in results), dtype=np.float64, count=len(results))
+      lngs = np.fromiter((r["geometry"]["location"]["lng"] for r in results), dtype=np.float64, count=len(results))
+      for result, distance in zip(results, np.round(_haversine_km(lat, lng, lats, lngs), 2).tolist()):
+        result["distance_km"] = distance
+    
+    return {"results": results, "status": "OK"}
       
   except httpx.RequestError as e:
-    import logging
-    logging.error(f"HTTP error fetching places: {e}", exc_info=True)
+    logger.error("HTTP error fetching places: %s", e, exc_info=True)
     return {"results": [], "status": "HTTP_ERROR"}
   except Exception as e:
-    import logging
-    logging.error(f"Error fetching nearby places: {e}", exc_info=True)
+    logger.error("Error fetching nearby places: %s", e, exc_info=True)
     return {"results": [], "status": "ERROR"}
 
 
+# Recommendations for a property stay within this distance of it
+RECOMMENDATION_RADIUS_M = 10_000
+
+PROPERTY_RECOMMENDATION_TARGET_STMT = text("""
+  SELECT no, property_type, price, latitude, longitude, num_rooms, num_bathrooms,
+         floor_area_m2, smart_living_score, amenities, location
+  FROM real_estate_data
+  WHERE no = :property_id
+""")
+
+PROPERTY_RECOMMENDATION_QUERY = """
+  SELECT
+    no,
+    property_type,
+    price,
+    COALESCE(NULLIF(location, ''), 'Unknown') AS location,
+    latitude,
+    longitude,
+    num_rooms,
+    num_bathrooms,
+    floor_area_m2,
+    smart_living_score
+  FROM real_estate_data
+  WHERE {where_clause}
+  ORDER BY 
+    CASE WHEN property_type = :preferred_type THEN 0 ELSE 1 END,
+    ABS(price - :target_price) ASC,
+    smart_living_score DESC
+  LIMIT :limit
+"""
+
+
+@lru_cache(maxsize=16)
+def _property_recommendation_statement(where_clause: str) -> TextClause:
+  # At most 16 variants: each of the four optional conditions is present or not
+  return text(PROPERTY_RECOMMENDATION_QUERY.format(where_clause=where_clause))
+
+
 @app.get("/api/recommendations/{property_id}", response_model=List[SearchProperty], tags=["recommendations"])
 async def get_recommendations_by_property(
   property_id: int,
@@ -770,16 +785,9 @@ async def get_recommendations_by_property(
   try:
     engine = get_engine()
     
-    # Get the target property
-    target_query = text("""
-      SELECT no, property_type, price, latitude, longitude, num_rooms, num_bathrooms,
-             floor_area_m2, smart_living_score, amenities, location
-      FROM real_estate_data
-      WHERE no = :property_id
-    """)
-    
-    with engine.connect() as conn:
-      target = conn.execute(target_query, {"property_id": property_id}).mappings().first()
+    async with engine.connect() as conn:
+      # Get the target property
+      target = (await conn.execute(PROPERTY_RECOMMENDATION_TARGET_STMT, {"property_id": property_id})).mappings().first()
       
       if not target:
         raise HTTPException(status_code=404, detail="Property not found")
@@ -804,75 +812,103 @@ async def get_recommendations_by_property(
         params["max_price"] = target_price * 1.3
       
       if target_lat and target_lng:
-        conditions.append("""
-          (6371 * acos(
-            cos(radians(:target_lat)) * cos(radians(latitude)) *
-            cos(radians(longitude) - radians(:target_lng)) +
-            sin(radians(:target_lat)) * sin(radians(latitude))
-          )) <= 10
-        """)
+        # geom is the indexed geography point maintained by Scripts/Database/migrate_query_performance.py
+        conditions.append("ST_DWithin(geom, ST_SetSRID(ST_MakePoint(:target_lng, :target_lat), 4326)::geography, :radius_m)")
         params["target_lat"] = target_lat
         params["target_lng"] = target_lng
+        params["radius_m"] = RECOMMENDATION_RADIUS_M
       
       if target_score:
         conditions.append("smart_living_score >= :min_score")
         params["min_score"] = max(target_score - 10, 50)
       
-      where_clause = " AND ".join(conditions)
-      
-      recommendations_query = text(f"""
-        SELECT
-          no,
-          property_type,
-          price,
-          location,
-          latitude,
-          longitude,
-          num_rooms,
-          num_bathrooms,
-          floor_area_m2,
-          smart_living_score
-        FROM real_estate_data
-        WHERE {where_clause}
-        ORDER BY 
-          CASE WHEN property_type = :property_type THEN 0 ELSE 1 END,
-          ABS(price - :target_price) ASC,
-          smart_living_score DESC
-        LIMIT :limit
-      """)
-      
       params["target_price"] = target_price or 0
       params["preferred_type"] = target_type or ""
       
-      results = conn.execute(recommendations_query, params).mappings().all()
-    
-    recommendations: List[SearchProperty] = []
-    for row in results:
-      recommendations.append(
-        SearchProperty(
-          no=int(row["no"]),
-          property_type=row.get("property_type"),
-          price=row.get("price"),
-          location=str(row.get("location") or "Unknown"),
-          latitude=float(row["latitude"]) if row.get("latitude") is not None else None,
-          longitude=float(row["longitude"]) if row.get("longitude") is not None else None,
-          num_rooms=row.get("num_rooms"),
-          num_bathrooms=row.get("num_bathrooms"),
-          floor_area_m2=float(row["floor_area_m2"]) if row.get("floor_area_m2") is not None else None,
-          smart_living_score=float(row["smart_living_score"]) if row.get("smart_living_score") is not None else None,
-        )
-      )
-    
-    return recommendations
+      stmt = _property_recommendation_statement(" AND ".join(conditions))
+      results = _iter_rows(conn, stmt, params, limit)
+      return _rows_to_search_properties([row._mapping async for row in results])
     
   except HTTPException:
     raise
   except Exception as e:
-    import logging
-    logging.error(f"Error getting recommendations for property {property_id}: {e}", exc_info=True)
+    logger.error("Error getting recommendations for property %s: %s", property_id, e, exc_info=True)
     return []
 
 
+SAVED_IDS_STMT = text("""
+  SELECT property_no FROM saved_properties WHERE user_id = :user_id
+""")
+
+VIEWED_IDS_STMT = text("""
+  SELECT DISTINCT property_id FROM user_interactions 
+  WHERE user_id = :user_id AND interaction_type = 'viewed'
+""")
+
+COLD_RECOMMENDATION_STMT = text("""
+  SELECT
+    no,
+    property_type,
+    price,
+    COALESCE(NULLIF(location, ''), 'Unknown') AS location,
+    latitude,
+    longitude,
+    num_rooms,
+    num_bathrooms,
+    floor_area_m2,
+    smart_living_score
+  FROM real_estate_data
+  WHERE smart_living_score >= 70
+  ORDER BY smart_living_score DESC, price ASC
+  LIMIT :limit
+""")
+
+PREFERENCES_STMT = text("""
+  SELECT
+    AVG(price) as avg_price,
+    mode() WITHIN GROUP (ORDER BY property_type) as preferred_type,
+    AVG(num_rooms) as avg_rooms,
+    AVG(num_bathrooms) as avg_baths,
+    AVG(smart_living_score) as avg_score
+  FROM real_estate_data
+  JOIN unnest(CAST(:property_ids AS integer[])) AS u(id) ON real_estate_data.no = u.id
+""")
+
+PERSONALIZED_RECOMMENDATION_QUERY = """
+  SELECT
+    no,
+    property_type,
+    price,
+    COALESCE(NULLIF(location, ''), 'Unknown') AS location,
+    latitude,
+    longitude,
+    num_rooms,
+    num_bathrooms,
+    floor_area_m2,
+    smart_living_score
+  FROM real_estate_data
+  WHERE NOT EXISTS (SELECT 1 FROM unnest(CAST(:excluded_ids AS integer[])) AS x(id) WHERE x.id = real_estate_data.no)
+    {type_clause}
+    {price_clause}
+    AND smart_living_score >= :min_score
+  ORDER BY 
+    CASE WHEN property_type = :preferred_type THEN 0 ELSE 1 END,
+    smart_living_score DESC,
+    ABS(price - :target_price) ASC
+  LIMIT :limit
+"""
+
+# Keyed by (has_preferred_type, has_avg_price)
+PERSONALIZED_RECOMMENDATION_STMTS = {
+  (has_type, has_price): text(PERSONALIZED_RECOMMENDATION_QUERY.format(
+    type_clause="AND property_type = :preferred_type" if has_type else "",
+    price_clause="AND price BETWEEN :min_price AND :max_price" if has_price else "",
+  ))
+  for has_type in (False, True)
+  for has_price in (False, True)
+}
+
+
 @app.get("/api/recommendations", response_model=List[SearchProperty], tags=["recommendations"])
 async def get_recommendations(
   current_user: dict = Depends(get_current_user),
@@ -882,125 +918,53 @@ async def get_recommendations(
   try:
     engine = get_engine()
     user_id = current_user["id"]
+    # Taken before reading the ids so a save, unsave or view flush meanwhile keeps
+    # preferences built from the old ids out of the cache
+    prefs_version = PREFERENCES_CACHE.version(user_id)
     
-    with engine.connect() as conn:
+    async with engine.connect() as conn:
       # Get user's saved and viewed properties
-      saved_query = text("""
-        SELECT property_no FROM saved_properties WHERE user_id = :user_id
-      """)
-      saved_ids = [row["property_no"] for row in conn.execute(saved_query, {"user_id": user_id}).mappings().all()]
-      
-      viewed_query = text("""
-        SELECT DISTINCT property_id FROM user_interactions 
-        WHERE user_id = :user_id AND interaction_type = 'viewed'
-      """)
-      viewed_ids = [row["property_id"] for row in conn.execute(viewed_query, {"user_id": user_id}).mappings().all()]
+      saved_ids = [row["property_no"] for row in (await conn.execute(SAVED_IDS_STMT, {"user_id": user_id})).mappings().all()]
+      viewed_ids = [row["property_id"] for row in (await conn.execute(VIEWED_IDS_STMT, {"user_id": user_id})).mappings().all()]
       
       all_interacted_ids = list(set(saved_ids + viewed_ids))
       
       if not all_interacted_ids:
         # No interactions yet - return high-scored properties
-        recommendations_query = text("""
-          SELECT
-            no,
-            property_type,
-            price,
-            location,
-            latitude,
-            longitude,
-            num_rooms,
-            num_bathrooms,
-            floor_area_m2,
-            smart_living_score
-          FROM real_estate_data
-          WHERE smart_living_score >= 70
-          ORDER BY smart_living_score DESC, price ASC
-          LIMIT :limit
-        """)
-        results = conn.execute(recommendations_query, {"limit": limit}).mappings().all()
+        results = _iter_rows(conn, COLD_RECOMMENDATION_STMT, {"limit": limit}, limit)
       else:
         # Find properties similar to user's interactions
         # Get average preferences from interacted properties
-        preferences_query = text("""
-          SELECT
-            AVG(price) as avg_price,
-            (SELECT property_type FROM real_estate_data WHERE no = ANY(:property_ids) GROUP BY property_type ORDER BY COUNT(*) DESC LIMIT 1) as preferred_type,
-            AVG(num_rooms) as avg_rooms,
-            AVG(num_bathrooms) as avg_baths,
-            AVG(smart_living_score) as avg_score
-          FROM real_estate_data
-          WHERE no = ANY(:property_ids)
-        """)
-        prefs = conn.execute(preferences_query, {"property_ids": all_interacted_ids}).mappings().first()
-        
-        avg_price = float(prefs["avg_price"]) if prefs.get("avg_price") else None
-        preferred_type = prefs.get("preferred_type")
-        avg_score = float(prefs["avg_score"]) if prefs.get("avg_score") else 60
-        
-        # Build recommendation query
-        conditions = ["no != ALL(:excluded_ids)"]
-        params = {"excluded_ids": all_interacted_ids, "limit": limit}
+        prefs = PREFERENCES_CACHE.get(user_id)
+        if prefs is None:
+          row = (await conn.execute(PREFERENCES_STMT, {"property_ids": all_interacted_ids})).mappings().first()
+          prefs = {
+            "avg_price": float(row["avg_price"]) if row.get("avg_price") else None,
+            "preferred_type": row.get("preferred_type"),
+            "avg_score": float(row["avg_score"]) if row.get("avg_score") else 60,
+          }
+          PREFERENCES_CACHE.set(user_id, prefs, version=prefs_version)
         
-        if preferred_type:
-          conditions.append("property_type = :preferred_type")
-          params["preferred_type"] = preferred_type
+        avg_price = prefs["avg_price"]
+        preferred_type = prefs["preferred_type"]
+        avg_score = prefs["avg_score"]
         
+        params = {
+          "excluded_ids": all_interacted_ids,
+          "limit": limit,
+          "min_score": max(avg_score - 10, 50),
+          "target_price": avg_price or 0,
+          "preferred_type": preferred_type or "",
+        }
         if avg_price:
-          conditions.append("price BETWEEN :min_price AND :max_price")
           params["min_price"] = avg_price * 0.7
           params["max_price"] = avg_price * 1.5
         
-        conditions.append("smart_living_score >= :min_score")
-        params["min_score"] = max(avg_score - 10, 50)
-        
-        where_clause = " AND ".join(conditions)
-        
-        recommendations_query = text(f"""
-          SELECT
-            no,
-            property_type,
-            price,
-            location,
-            latitude,
-            longitude,
-            num_rooms,
-            num_bathrooms,
-            floor_area_m2,
-            smart_living_score
-          FROM real_estate_data
-          WHERE {where_clause}
-          ORDER BY 
-            CASE WHEN property_type = :preferred_type THEN 0 ELSE 1 END,
-            smart_living_score DESC,
-            ABS(price - :target_price) ASC
-          LIMIT :limit
-        """)
-        params["target_price"] = avg_price or 0
-        params["preferred_type"] = preferred_type or ""
-        
-        results = conn.execute(recommendations_query, params).mappings().all()
-      
-      recommendations: List[SearchProperty] = []
-      for row in results:
-        recommendations.append(
-          SearchProperty(
-            no=int(row["no"]),
-            property_type=row.get("property_type"),
-            price=row.get("price"),
-            location=str(row.get("location") or "Unknown"),
-            latitude=float(row["latitude"]) if row.get("latitude") is not None else None,
-            longitude=float(row["longitude"]) if row.get("longitude") is not None else None,
-            num_rooms=row.get("num_rooms"),
-            num_bathrooms=row.get("num_bathrooms"),
-            floor_area_m2=float(row["floor_area_m2"]) if row.get("floor_area_m2") is not None else None,
-            smart_living_score=float(row["smart_living_score"]) if row.get("smart_living_score") is not None else None,
-          )
-        )
+        stmt = PERSONALIZED_RECOMMENDATION_STMTS[(bool(preferred_type), bool(avg_price))]
+        results = _iter_rows(conn, stmt, params, limit)
       
-      return recommendations
+      return _rows_to_search_properties([row._mapping async for row in results])
       
   except Exception as e:
-    import logging
-    logging.error(f"Error getting recommendations: {e}", exc_info=True)
+    logger.error("Error getting recommendations: %s", e, exc_info=True)
     return []
-
@@ -5,50 +5,137 @@ Handles signup, login, OAuth, and token refresh.
 
 from __future__ import annotations
 
+import hashlib
+import hmac
+import logging
 import os
-from typing import Optional
-
-from fastapi import APIRouter, Depends, HTTPException, status
+import secrets
+import time
+from typing import Annotated, Optional
+from urllib.parse import urlencode
+
+import httpx
+import orjson
+from fastapi import APIRouter, Cookie, Depends, Form, HTTPException, status
 from fastapi.responses import RedirectResponse
-from pydantic import BaseModel, EmailStr
-from sqlalchemy import create_engine, text
-from sqlalchemy.engine import Engine
+from jose import jwt
+from pydantic import AfterValidator, BaseModel, EmailStr, Field
+from sqlalchemy import text
 
 from dotenv import load_dotenv
 from app.auth import (
+    PASSWORD_MAX_LENGTH,
+    SECRET_KEY,
     create_access_token,
     create_refresh_token,
     get_current_user,
-    hash_password,
+    hash_password_async,
+    rotate_refresh_token,
     save_refresh_token,
-    verify_password,
+    user_token_claims,
+    verify_password_async,
     verify_refresh_token,
     revoke_refresh_token,
 )
+from app.cache import OAUTH_JWKS_CACHE
+from app.database import get_engine
 
 load_dotenv()
 
+# OAuth settings, read from the environment once at import
+FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:5173")
+GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
+GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
+GOOGLE_REDIRECT_URI = os.getenv("GOOGLE_REDIRECT_URI", "http://localhost:8000/auth/google/callback")
+FACEBOOK_CLIENT_ID = os.getenv("FACEBOOK_CLIENT_ID")
+FACEBOOK_CLIENT_SECRET = os.getenv("FACEBOOK_CLIENT_SECRET")
+FACEBOOK_REDIRECT_URI = os.getenv("FACEBOOK_REDIRECT_URI", "http://localhost:8000/auth/facebook/callback")
+APPLE_CLIENT_ID = os.getenv("APPLE_CLIENT_ID")  # Service ID
+APPLE_CLIENT_SECRET = os.getenv("APPLE_CLIENT_SECRET")  # JWT signed with private key
+APPLE_REDIRECT_URI = os.getenv("APPLE_REDIRECT_URI", "http://localhost:8000/auth/apple/callback")
+
+# Authorize URLs minus the per-request state, which login routes append
+FACEBOOK_AUTH_URL_PREFIX = "https://www.facebook.com/v18.0/dialog/oauth?" + urlencode({
+    "client_id": FACEBOOK_CLIENT_ID or "",
+    "redirect_uri": FACEBOOK_REDIRECT_URI,
+    "scope": "email,public_profile",
+})
+APPLE_AUTH_URL_PREFIX = "https://appleid.apple.com/auth/authorize?" + urlencode({
+    "client_id": APPLE_CLIENT_ID or "",
+    "redirect_uri": APPLE_REDIRECT_URI,
+    "response_type": "code",
+    "scope": "email name",
+    "response_mode": "form_post",
+})
+
 router = APIRouter(prefix="/auth", tags=["authentication"])
 
+logger = logging.getLogger(__name__)
 
-def get_engine() -> Engine:
-    """Get database engine."""
-    database_url = os.getenv("DATABASE_URL")
-    if not database_url:
-        raise RuntimeError("DATABASE_URL environment variable is required.")
-    return create_engine(database_url, pool_pre_ping=True)
+# Shared by the Facebook and Apple callbacks so logins reuse warm TLS connections; closed on shutdown
+OAUTH_CLIENT = httpx.AsyncClient(
+    timeout=10.0,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+)
+
+# OAuth state is signed rather than stored, so callbacks verify it without a lookup;
+# its nonce is also set in a cookie so a callback only succeeds in the browser that logged in
+OAUTH_STATE_MAX_AGE_SECONDS = 600
+OAUTH_STATE_COOKIE = "oauth_state"
+
+# id_tokens are verified locally against the providers' published signing keys
+GOOGLE_ISSUERS = ("https://accounts.google.com", "accounts.google.com")
+GOOGLE_KEYS_URL = "https://www.googleapis.com/oauth2/v3/certs"
+APPLE_ISSUER = "https://appleid.apple.com"
+APPLE_KEYS_URL = "https://appleid.apple.com/auth/keys"
+
+# SQL statements, compiled once
+FIND_OR_CREATE_OAUTH_USER_STMT = text("""
+    WITH existing AS (
+        SELECT id, email, name, oauth_provider FROM users
+        WHERE oauth_id = :oauth_id AND oauth_provider = :provider
+    ), upserted AS (
+        INSERT INTO users (email, name, oauth_provider, oauth_id)
+        SELECT :email, :name, :provider, :oauth_id
+        WHERE NOT EXISTS (SELECT 1 FROM existing)
+        -- Link OAuth to an existing account with the same email
+        ON CONFLICT (email) DO UPDATE
+        SET oauth_provider = EXCLUDED.oauth_provider, oauth_id = EXCLUDED.oauth_id
+        RETURNING id, email, name, oauth_provider
+    )
+    SELECT * FROM existing
+    UNION ALL
+    SELECT * FROM upserted
+""")
+INSERT_EMAIL_USER_STMT = text("""
+    INSERT INTO users (email, password_hash, name, oauth_provider)
+    VALUES (:email, :password_hash, :name, 'email')
+    ON CONFLICT (email) DO NOTHING
+    RETURNING id, email, name, oauth_provider
+""")
+SELECT_USER_BY_EMAIL_STMT = text("SELECT id, email, password_hash, name, oauth_provider FROM users WHERE email = :email")
 
 
 # Request/Response Models
+def _reject_nul(password: str) -> str:
+    if "\x00" in password:
+        raise ValueError("Password must not contain null characters")
+    return password
+
+
+# Bounded before bcrypt ever sees it, so oversize payloads are rejected up front
+Password = Annotated[str, Field(max_length=PASSWORD_MAX_LENGTH), AfterValidator(_reject_nul)]
+
+
 class SignUpRequest(BaseModel):
     email: EmailStr
-    password: str
+    password: Password
     name: Optional[str] = None
 
 
 class LoginRequest(BaseModel):
     email: EmailStr
-    password: str
+    password: Password
 
 
 class TokenResponse(BaseModel):
@@ -69,6 +156,126 @@ class UserResponse(BaseModel):
     oauth_provider: Optional[str]
 
 
+async def find_or_create_oauth_user(provider: str, oauth_id: str, email: str, name: Optional[str]) -> dict:
+    """Return the user linked to this OAuth identity, linking or creating one by email."""
+    engine = get_engine()
+    async with engine.begin() as conn:
+        user = (await conn.execute(
+            FIND_OR_CREATE_OAUTH_USER_STMT,
+            {
+                "provider": provider,
+                "oauth_id": oauth_id,
+                "email": email.lower(),
+                "name": name
+            }
+        )).mappings().one()
+    
+    return dict(user)
+
+
+def token_response(access_token: str, refresh_token: str, user) -> dict:
+    """TokenResponse payload as a plain dict.
+
+    The routes declare response_model=TokenResponse, so FastAPI validates and
+    serializes this once; building the model here too would do it twice.
+    """
+    return {
+        "access_token": access_token,
+        "refresh_token": refresh_token,
+        "token_type": "bearer",
+        "user": {
+            "id": user["id"],
+            "email": user["email"],
+            "name": user["name"],
+            "oauth_provider": user["oauth_provider"]
+        }
+    }
+
+
+def create_oauth_state() -> str:
+    """Signed, timestamped OAuth state: "<nonce>.<issued_at>.<signature>"."""
+    payload = f"{secrets.token_urlsafe(16)}.{int(time.time())}"
+    return f"{payload}.{_sign_oauth_state(payload)}"
+
+
+def verify_oauth_state(state: Optional[str], cookie_nonce: Optional[str]) -> bool:
+    """Check an OAuth state's signature and age, and that its nonce matches the browser's cookie."""
+    try:
+        nonce, issued_at, signature = (state or "").split(".")
+        age = time.time() - int(issued_at)
+    except ValueError:
+        return False
+    # Compared as bytes: compare_digest raises on non-ASCII str, and both values are client input
+    return (
+        hmac.compare_digest(
+            signature.encode("utf-8"), _sign_oauth_state(f"{nonce}.{issued_at}").encode("utf-8")
+        )
+        and hmac.compare_digest(nonce.encode("utf-8"), (cookie_nonce or "").encode("utf-8"))
+        and 0 <= age <= OAUTH_STATE_MAX_AGE_SECONDS
+    )
+
+
+def oauth_login_redirect(url: str, state: str, samesite: str = "lax") -> RedirectResponse:
+    """Redirect to a provider, pinning the state's nonce to this browser in a short-lived cookie."""
+    response = RedirectResponse(url=url)
+    response.set_cookie(
+        OAUTH_STATE_COOKIE,
+        state.split(".", 1)[0],
+        max_age=OAUTH_STATE_MAX_AGE_SECONDS,
+        httponly=True,
+        samesite=samesite,
+        # Browsers only accept SameSite=None cookies when they are Secure
+        secure=samesite == "none",
+    )
+    return response
+
+
+def clear_oauth_state(response: RedirectResponse) -> RedirectResponse:
+    """Drop the state cookie once a callback has used it."""
+    response.delete_cookie(OAUTH_STATE_COOKIE)
+    return response
+
+
+def _sign_oauth_state(payload: str) -> str:
+    return hmac.new(SECRET_KEY.encode("utf-8"), payload.encode("utf-8"), hashlib.sha256).hexdigest()[:32]
+
+
+async def provider_signing_keys(keys_url: str, refresh: bool = False) -> dict:
+    """A provider's JWKS, fetched once and cached for a day."""
+    keys = None if refresh else OAUTH_JWKS_CACHE.get(keys_url)
+    if keys is None:
+        resp = await OAUTH_CLIENT.get(keys_url)
+        resp.raise_for_status()
+        keys = resp.json()
+        OAUTH_JWKS_CACHE.set(keys_url, keys)
+    return keys
+
+
+async def verify_id_token(
+    id_token: str,
+    keys_url: str,
+    audience: str,
+    issuer,
+    access_token: Optional[str] = None
+) -> dict:
+    """Verify an id_token's signature, audience and issuer locally and return its claims."""
+    keys = await provider_signing_keys(keys_url)
+    # Providers rotate keys occasionally; refetch once if the token's key is not cached
+    kid = jwt.get_unverified_header(id_token).get("kid")
+    if kid not in {key.get("kid") for key in keys.get("keys", [])}:
+        keys = await provider_signing_keys(keys_url, refresh=True)
+    return jwt.decode(
+        id_token,
+        keys,
+        algorithms=["RS256"],
+        audience=audience,
+        issuer=issuer,
+        access_token=access_token,
+        # at_hash can only be checked against the access token it was issued with
+        options={"verify_at_hash": access_token is not None},
+    )
+
+
 # Routes
 @router.post("/signup", response_model=TokenResponse, status_code=status.HTTP_201_CREATED)
 async def signup(request: SignUpRequest):
@@ -79,53 +286,32 @@ async def signup(request: SignUpRequest):
             detail="Password must be at least 6 characters"
         )
     
-    engine = get_engine()
+    password_hash = await hash_password_async(request.password)
     
-    # Check if user already exists
-    with engine.connect() as conn:
-        existing = conn.execute(
-            text("SELECT id FROM users WHERE email = :email"),
-            {"email": request.email.lower()}
-        ).mappings().first()
-        
-        if existing:
-            raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT,
-                detail="Email already registered"
-            )
-        
-        # Create user
-        password_hash = hash_password(request.password)
-        result = conn.execute(
-            text("""
-                INSERT INTO users (email, password_hash, name, oauth_provider)
-                VALUES (:email, :password_hash, :name, 'email')
-                RETURNING id, email, name, oauth_provider
-            """),
+    # The unique email index rejects duplicates, so no existence check is needed first
+    engine = get_engine()
+    async with engine.begin() as conn:
+        user = (await conn.execute(
+            INSERT_EMAIL_USER_STMT,
             {
                 "email": request.email.lower(),
                 "password_hash": password_hash,
                 "name": request.name
             }
+        )).mappings().first()
+    
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Email already registered"
         )
-        user = result.mappings().first()
-        conn.commit()
     
     # Create tokens
-    access_token = create_access_token(data={"sub": user["id"]})
-    refresh_token = create_refresh_token(data={"sub": user["id"]})
-    save_refresh_token(user["id"], refresh_token)
+    access_token = create_access_token(data=user_token_claims(user))
+    refresh_token = create_refresh_token(data={"sub": str(user["id"])})
+    await save_refresh_token(user["id"], refresh_token)
     
-    return TokenResponse(
-        access_token=access_token,
-        refresh_token=refresh_token,
-        user={
-            "id": user["id"],
-            "email": user["email"],
-            "name": user["name"],
-            "oauth_provider": user["oauth_provider"]
-        }
-    )
+    return token_response(access_token, refresh_token, user)
 
 
 @router.post("/login", response_model=TokenResponse)
@@ -133,11 +319,11 @@ async def login(request: LoginRequest):
     """Login with email and password."""
     engine = get_engine()
     
-    with engine.connect() as conn:
-        user = conn.execute(
-            text("SELECT id, email, password_hash, name, oauth_provider FROM users WHERE email = :email"),
+    async with engine.connect() as conn:
+        user = (await conn.execute(
+            SELECT_USER_BY_EMAIL_STMT,
             {"email": request.email.lower()}
-        ).mappings().first()
+        )).mappings().first()
         
         if not user:
             raise HTTPException(
@@ -151,35 +337,26 @@ async def login(request: LoginRequest):
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Please sign in with your OAuth provider"
             )
-        
-        # Verify password
-        if not verify_password(request.password, user["password_hash"]):
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid email or password"
-            )
+    
+    # Verify password
+    if not await verify_password_async(request.password, user["password_hash"]):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid email or password"
+        )
     
     # Create tokens
-    access_token = create_access_token(data={"sub": user["id"]})
-    refresh_token = create_refresh_token(data={"sub": user["id"]})
-    save_refresh_token(user["id"], refresh_token)
+    access_token = create_access_token(data=user_token_claims(user))
+    refresh_token = create_refresh_token(data={"sub": str(user["id"])})
+    await save_refresh_token(user["id"], refresh_token)
     
-    return TokenResponse(
-        access_token=access_token,
-        refresh_token=refresh_token,
-        user={
-            "id": user["id"],
-            "email": user["email"],
-            "name": user["name"],
-            "oauth_provider": user["oauth_provider"]
-        }
-    )
+    return token_response(access_token, refresh_token, user)
 
 
 @router.get("/me", response_model=UserResponse)
 async def get_current_user_info(current_user: dict = Depends(get_current_user)):
     """Get current authenticated user information."""
-    return UserResponse(**current_user)
+    return current_user
 
 
 @router.post("/refresh", response_model=TokenResponse)
@@ -193,38 +370,27 @@ async def refresh_token(request: RefreshTokenRequest):
             detail="Invalid or expired refresh token"
         )
     
-    # Create new tokens
-    access_token = create_access_token(data={"sub": user_info["user_id"]})
-    refresh_token = create_refresh_token(data={"sub": user_info["user_id"]})
+    # Create new refresh token
+    refresh_token = create_refresh_token(data={"sub": str(user_info["user_id"])})
     
-    # Revoke old token and save new one
-    revoke_refresh_token(request.refresh_token)
-    save_refresh_token(user_info["user_id"], refresh_token)
+    # Revoke old token, save new one and get user info
+    user = await rotate_refresh_token(request.refresh_token, refresh_token)
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired refresh token"
+        )
     
-    # Get user info
-    engine = get_engine()
-    with engine.connect() as conn:
-        user = conn.execute(
-            text("SELECT id, email, name, oauth_provider FROM users WHERE id = :user_id"),
-            {"user_id": user_info["user_id"]}
-        ).mappings().first()
+    # Access token carries the current profile
+    access_token = create_access_token(data=user_token_claims(user))
     
-    return TokenResponse(
-        access_token=access_token,
-        refresh_token=refresh_token,
-        user={
-            "id": user["id"],
-            "email": user["email"],
-            "name": user["name"],
-            "oauth_provider": user["oauth_provider"]
-        }
-    )
+    return token_response(access_token, refresh_token, user)
 
 
 @router.post("/logout")
 async def logout(request: RefreshTokenRequest):
     """Logout by revoking refresh token."""
-    revoke_refresh_token(request.refresh_token)
+    await revoke_refresh_token(request.refresh_token)
     return {"message": "Logged out successfully"}
 
 
@@ -240,473 +406,287 @@ async def google_login():
             detail="OAuth library not installed. Install with: pip install authlib"
         )
     
-    client_id = os.getenv("GOOGLE_CLIENT_ID")
-    redirect_uri = os.getenv("GOOGLE_REDIRECT_URI", "http://localhost:8000/auth/google/callback")
-    
-    if not client_id:
+    if not GOOGLE_CLIENT_ID:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail="Google OAuth not configured. Set GOOGLE_CLIENT_ID in environment variables."
         )
     
     client = AsyncOAuth2Client(
-        client_id=client_id,
-        client_secret=os.getenv("GOOGLE_CLIENT_SECRET"),
-        redirect_uri=redirect_uri
+        client_id=GOOGLE_CLIENT_ID,
+        client_secret=GOOGLE_CLIENT_SECRET,
+        redirect_uri=GOOGLE_REDIRECT_URI
     )
     
     authorization_url, state = client.create_authorization_url(
         "https://accounts.google.com/o/oauth2/v2/auth",
-        scope="openid email profile"
+        scope="openid email profile",
+        state=create_oauth_state()
     )
     
-    # Store state in session/cookie (simplified - in production use secure session)
-    return RedirectResponse(url=authorization_url)
+    return oauth_login_redirect(authorization_url, state)
 
 
 @router.get("/google/callback")
-async def google_callback(code: str, state: Optional[str] = None):
+async def google_callback(
+    code: str,
+    state: Optional[str] = None,
+    oauth_state: Optional[str] = Cookie(default=None)
+):
     """Handle Google OAuth callback."""
+    return clear_oauth_state(await google_callback_handler(code, state, oauth_state))
+
+
+async def google_callback_handler(code: str, state: Optional[str], cookie_nonce: Optional[str]):
+    """Exchange a Google authorization code and sign the user in."""
     try:
         from authlib.integrations.httpx_client import AsyncOAuth2Client
     except ImportError:
-        frontend_url = os.getenv("FRONTEND_URL", "http://localhost:5173")
-        return RedirectResponse(f"{frontend_url}/signin?error=oauth_not_installed")
+        return RedirectResponse(f"{FRONTEND_URL}/signin?error=oauth_not_installed")
     
-    client_id = os.getenv("GOOGLE_CLIENT_ID")
-    client_secret = os.getenv("GOOGLE_CLIENT_SECRET")
-    redirect_uri = os.getenv("GOOGLE_REDIRECT_URI", "http://localhost:8000/auth/google/callback")
-    frontend_url = os.getenv("FRONTEND_URL", "http://localhost:5173")
+    if not GOOGLE_CLIENT_ID or not GOOGLE_CLIENT_SECRET:
+        return RedirectResponse(f"{FRONTEND_URL}/signin?error=oauth_not_configured")
     
-    if not client_id or not client_secret:
-        return RedirectResponse(f"{frontend_url}/signin?error=oauth_not_configured")
+    if not verify_oauth_state(state, cookie_nonce):
+        return RedirectResponse(f"{FRONTEND_URL}/signin?error=oauth_failed")
     
-    client = AsyncOAuth2Client(client_id=client_id, client_secret=client_secret)
+    client = AsyncOAuth2Client(client_id=GOOGLE_CLIENT_ID, client_secret=GOOGLE_CLIENT_SECRET)
     
     try:
-        token = await client.fetch_token(
-            "https://oauth2.googleapis.com/token",
-            code=code,
-            redirect_uri=redirect_uri
-        )
-        
-        # Get user info from Google
         async with client:
-            resp = await client.get(
-                "https://www.googleapis.com/oauth2/v2/userinfo",
-                token=token
+            token = await client.fetch_token(
+                "https://oauth2.googleapis.com/token",
+                code=code,
+                redirect_uri=GOOGLE_REDIRECT_URI
             )
-            google_user = resp.json()
         
-        # Find or create user
-        engine = get_engine()
-        with engine.connect() as conn:
-            user = conn.execute(
-                text("""
-                    SELECT id, email, name, oauth_provider
-                    FROM users
-                    WHERE oauth_id = :oauth_id AND oauth_provider = 'google'
-                """),
-                {"oauth_id": google_user["id"]}
-            ).mappings().first()
-            
-            if not user:
-                # Check if email exists
-                existing_email = conn.execute(
-                    text("SELECT id FROM users WHERE email = :email"),
-                    {"email": google_user["email"].lower()}
-                ).mappings().first()
-                
-                if existing_email:
-                    # Link OAuth to existing account
-                    conn.execute(
-                        text("""
-                            UPDATE users
-                            SET oauth_provider = 'google', oauth_id = :oauth_id
-                            WHERE id = :user_id
-                        """),
-                        {
-                            "oauth_id": google_user["id"],
-                            "user_id": existing_email["id"]
-                        }
-                    )
-                    user_id = existing_email["id"]
-                else:
-                    # Create new user
-                    result = conn.execute(
-                        text("""
-                            INSERT INTO users (email, name, oauth_provider, oauth_id)
-                            VALUES (:email, :name, 'google', :oauth_id)
-                            RETURNING id, email, name, oauth_provider
-                        """),
-                        {
-                            "email": google_user["email"].lower(),
-                            "name": google_user.get("name"),
-                            "oauth_id": google_user["id"]
-                        }
-                    )
-                    user = result.mappings().first()
-                    user_id = user["id"]
-            else:
-                user_id = user["id"]
-            
-            conn.commit()
+        # The openid scope returns an id_token with the profile, so no userinfo call is needed
+        google_user = await verify_id_token(
+            token["id_token"],
+            GOOGLE_KEYS_URL,
+            audience=GOOGLE_CLIENT_ID,
+            issuer=GOOGLE_ISSUERS,
+            access_token=token.get("access_token")
+        )
+        
+        account = await find_or_create_oauth_user(
+            "google", google_user["sub"], google_user["email"], google_user.get("name")
+        )
         
         # Create tokens
-        access_token = create_access_token(data={"sub": user_id})
-        refresh_token = create_refresh_token(data={"sub": user_id})
-        save_refresh_token(user_id, refresh_token)
+        access_token = create_access_token(data=user_token_claims(account))
+        refresh_token = create_refresh_token(data={"sub": str(account["id"])})
+        await save_refresh_token(account["id"], refresh_token)
         
         # Redirect to frontend with tokens
         return RedirectResponse(
-            f"{frontend_url}/auth/callback?access_token={access_token}&refresh_token={refresh_token}"
+            f"{FRONTEND_URL}/auth/callback?access_token={access_token}&refresh_token={refresh_token}"
         )
     
     except Exception as e:
-        return RedirectResponse(f"{frontend_url}/signin?error=oauth_failed")
+        return RedirectResponse(f"{FRONTEND_URL}/signin?error=oauth_failed")
 
 
 # OAuth Routes (Facebook)
 @router.get("/facebook/login")
 async def facebook_login():
     """Initiate Facebook OAuth login."""
-    client_id = os.getenv("FACEBOOK_CLIENT_ID")
-    redirect_uri = os.getenv("FACEBOOK_REDIRECT_URI", "http://localhost:8000/auth/facebook/callback")
-    
-    if not client_id:
+    if not FACEBOOK_CLIENT_ID:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail="Facebook OAuth not configured. Set FACEBOOK_CLIENT_ID in environment variables."
         )
     
-    auth_url = (
-        f"https://www.facebook.com/v18.0/dialog/oauth?"
-        f"client_id={client_id}&"
-        f"redirect_uri={redirect_uri}&"
-        f"scope=email,public_profile"
-    )
-    
-    return RedirectResponse(url=auth_url)
+    state = create_oauth_state()
+    return oauth_login_redirect(f"{FACEBOOK_AUTH_URL_PREFIX}&state={state}", state)
 
 
 @router.get("/facebook/callback")
-async def facebook_callback(code: str):
+async def facebook_callback(
+    code: str,
+    state: Optional[str] = None,
+    oauth_state: Optional[str] = Cookie(default=None)
+):
     """Handle Facebook OAuth callback."""
-    import httpx
-    
-    client_id = os.getenv("FACEBOOK_CLIENT_ID")
-    client_secret = os.getenv("FACEBOOK_CLIENT_SECRET")
-    redirect_uri = os.getenv("FACEBOOK_REDIRECT_URI", "http://localhost:8000/auth/facebook/callback")
-    frontend_url = os.getenv("FRONTEND_URL", "http://localhost:5173")
+    return clear_oauth_state(await facebook_callback_handler(code, state, oauth_state))
+
+
+async def facebook_callback_handler(code: str, state: Optional[str], cookie_nonce: Optional[str]):
+    """Exchange a Facebook authorization code and sign the user in."""
+    if not FACEBOOK_CLIENT_ID or not FACEBOOK_CLIENT_SECRET:
+        return RedirectResponse(f"{FRONTEND_URL}/signin?error=oauth_not_configured")
     
-    if not client_id or not client_secret:
-        return RedirectResponse(f"{frontend_url}/signin?error=oauth_not_configured")
+    if not verify_oauth_state(state, cookie_nonce):
+        return RedirectResponse(f"{FRONTEND_URL}/signin?error=oauth_failed")
     
     try:
         # Exchange code for token
-        async with httpx.AsyncClient() as client:
-            token_resp = await client.get(
-                "https://graph.facebook.com/v18.0/oauth/access_token",
-                params={
-                    "client_id": client_id,
-                    "client_secret": client_secret,
-                    "redirect_uri": redirect_uri,
-                    "code": code
-                }
-            )
-            token_data = token_resp.json()
-            access_token = token_data.get("access_token")
-            
-            # Get user info
-            user_resp = await client.get(
-                "https://graph.facebook.com/v18.0/me",
-                params={
-                    "fields": "id,name,email",
-                    "access_token": access_token
-                }
-            )
-            fb_user = user_resp.json()
+        token_resp = await OAUTH_CLIENT.get(
+            "https://graph.facebook.com/v18.0/oauth/access_token",
+            params={
+                "client_id": FACEBOOK_CLIENT_ID,
+                "client_secret": FACEBOOK_CLIENT_SECRET,
+                "redirect_uri": FACEBOOK_REDIRECT_URI,
+                "code": code
+            }
+        )
+        token_data = token_resp.json()
+        access_token = token_data.get("access_token")
         
-        # Find or create user
-        engine = get_engine()
-        with engine.connect() as conn:
-            user = conn.execute(
-                text("""
-                    SELECT id, email, name, oauth_provider
-                    FROM users
-                    WHERE oauth_id = :oauth_id AND oauth_provider = 'facebook'
-                """),
-                {"oauth_id": fb_user["id"]}
-            ).mappings().first()
-            
-            if not user:
-                # Check if email exists
-                existing_email = conn.execute(
-                    text("SELECT id FROM users WHERE email = :email"),
-                    {"email": fb_user.get("email", "").lower()}
-                ).mappings().first()
-                
-                if existing_email:
-                    conn.execute(
-                        text("""
-                            UPDATE users
-                            SET oauth_provider = 'facebook', oauth_id = :oauth_id
-                            WHERE id = :user_id
-                        """),
-                        {
-                            "oauth_id": fb_user["id"],
-                            "user_id": existing_email["id"]
-                        }
-                    )
-                    user_id = existing_email["id"]
-                else:
-                    result = conn.execute(
-                        text("""
-                            INSERT INTO users (email, name, oauth_provider, oauth_id)
-                            VALUES (:email, :name, 'facebook', :oauth_id)
-                            RETURNING id, email, name, oauth_provider
-                        """),
-                        {
-                            "email": fb_user.get("email", f"{fb_user['id']}@facebook.com").lower(),
-                            "name": fb_user.get("name"),
-                            "oauth_id": fb_user["id"]
-                        }
-                    )
-                    user = result.mappings().first()
-                    user_id = user["id"]
-            else:
-                user_id = user["id"]
-            
-            conn.commit()
+        # Get user info
+        user_resp = await OAUTH_CLIENT.get(
+            "https://graph.facebook.com/v18.0/me",
+            params={
+                "fields": "id,name,email",
+                "access_token": access_token
+            }
+        )
+        fb_user = user_resp.json()
+        
+        account = await find_or_create_oauth_user(
+            "facebook",
+            fb_user["id"],
+            fb_user.get("email") or f"{fb_user['id']}@facebook.com",
+            fb_user.get("name")
+        )
         
         # Create tokens
-        access_token_jwt = create_access_token(data={"sub": user_id})
-        refresh_token = create_refresh_token(data={"sub": user_id})
-        save_refresh_token(user_id, refresh_token)
+        access_token_jwt = create_access_token(data=user_token_claims(account))
+        refresh_token = create_refresh_token(data={"sub": str(account["id"])})
+        await save_refresh_token(account["id"], refresh_token)
         
         return RedirectResponse(
-            f"{frontend_url}/auth/callback?access_token={access_token_jwt}&refresh_token={refresh_token}"
+            f"{FRONTEND_URL}/auth/callback?access_token={access_token_jwt}&refresh_token={refresh_token}"
         )
     
     except Exception as e:
-        return RedirectResponse(f"{frontend_url}/signin?error=oauth_failed")
+        return RedirectResponse(f"{FRONTEND_URL}/signin?error=oauth_failed")
 
 
 # OAuth Routes (Apple)
 @router.get("/apple/login")
 async def apple_login():
     """Initiate Apple OAuth login."""
-    client_id = os.getenv("APPLE_CLIENT_ID")  # Service ID
-    redirect_uri = os.getenv("APPLE_REDIRECT_URI", "http://localhost:8000/auth/apple/callback")
-    
-    if not client_id:
+    if not APPLE_CLIENT_ID:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail="Apple OAuth not configured. Set APPLE_CLIENT_ID in environment variables."
         )
     
-    # Apple OAuth URL
-    auth_url = (
-        f"https://appleid.apple.com/auth/authorize?"
-        f"client_id={client_id}&"
-        f"redirect_uri={redirect_uri}&"
-        f"response_type=code&"
-        f"scope=email name&"
-        f"response_mode=form_post"
-    )
-    
-    return RedirectResponse(url=auth_url)
+    state = create_oauth_state()
+    # Apple posts the callback cross-site (form_post), which SameSite=Lax cookies are withheld from
+    return oauth_login_redirect(f"{APPLE_AUTH_URL_PREFIX}&state={state}", state, samesite="none")
 
 
 @router.post("/apple/callback")
 async def apple_callback_post(
-    code: Optional[str] = None,
-    id_token: Optional[str] = None,
-    user: Optional[str] = None
+    code: Optional[str] = Form(default=None),
+    id_token: Optional[str] = Form(default=None),
+    user: Optional[str] = Form(default=None),
+    state: Optional[str] = Form(default=None),
+    oauth_state: Optional[str] = Cookie(default=None)
 ):
     """Handle Apple OAuth callback (POST - form_post mode)."""
-    return await apple_callback_handler(code, id_token, user)
+    return clear_oauth_state(await apple_callback_handler(code, id_token, user, state, oauth_state))
 
 
 @router.get("/apple/callback")
 async def apple_callback_get(
     code: Optional[str] = None,
     id_token: Optional[str] = None,
-    user: Optional[str] = None
+    user: Optional[str] = None,
+    state: Optional[str] = None,
+    oauth_state: Optional[str] = Cookie(default=None)
 ):
     """Handle Apple OAuth callback (GET - fallback)."""
-    return await apple_callback_handler(code, id_token, user)
+    return clear_oauth_state(await apple_callback_handler(code, id_token, user, state, oauth_state))
+
+
+async def verify_apple_id_token(id_token: str, client_id: str) -> dict:
+    """Verify an Apple id_token's signature, audience and issuer and return its claims."""
+    return await verify_id_token(id_token, APPLE_KEYS_URL, audience=client_id, issuer=APPLE_ISSUER)
+
+
+def apple_user_name(user: Optional[str]) -> Optional[str]:
+    """Full name from the user JSON Apple posts on first sign-in only."""
+    if not user:
+        return None
+    try:
+        name = orjson.loads(user).get("name", {})
+        return (name.get("firstName", "") + " " + name.get("lastName", "")).strip() or None
+    except Exception:
+        return None
 
 
 async def apple_callback_handler(
     code: Optional[str] = None,
     id_token: Optional[str] = None,
-    user: Optional[str] = None
+    user: Optional[str] = None,
+    state: Optional[str] = None,
+    cookie_nonce: Optional[str] = None
 ):
     """Handle Apple OAuth callback."""
-    import httpx
-    import base64
-    import json
-    
-    client_id = os.getenv("APPLE_CLIENT_ID")
-    client_secret = os.getenv("APPLE_CLIENT_SECRET")  # JWT signed with private key
-    redirect_uri = os.getenv("APPLE_REDIRECT_URI", "http://localhost:8000/auth/apple/callback")
-    frontend_url = os.getenv("FRONTEND_URL", "http://localhost:5173")
+    if not APPLE_CLIENT_ID or not APPLE_CLIENT_SECRET:
+        return RedirectResponse(f"{FRONTEND_URL}/signin?error=oauth_not_configured")
     
-    if not client_id or not client_secret:
-        return RedirectResponse(f"{frontend_url}/signin?error=oauth_not_configured")
+    if not verify_oauth_state(state, cookie_nonce):
+        return RedirectResponse(f"{FRONTEND_URL}/signin?error=oauth_failed")
     
-    apple_user = None
-    
-    # If we have id_token, decode it to get user info
-    if id_token:
-        try:
-            # Decode JWT (without verification for simplicity - in production, verify signature)
-            parts = id_token.split('.')
-            if len(parts) == 3:
-                # Decode payload (second part)
-                payload = parts[1]
-                # Add padding if needed
-                padding = 4 - len(payload) % 4
-                if padding != 4:
-                    payload += '=' * padding
-                decoded = base64.urlsafe_b64decode(payload)
-                apple_user_data = json.loads(decoded)
-                
-                apple_user = {
-                    "id": apple_user_data.get("sub"),
-                    "email": apple_user_data.get("email"),
-                    "name": None
-                }
-                
-                # Parse user object if provided (first time only)
-                if user:
-                    try:
-                        user_obj = json.loads(user)
-                        apple_user["name"] = user_obj.get("name", {}).get("firstName", "") + " " + user_obj.get("name", {}).get("lastName", "")
-                        apple_user["name"] = apple_user["name"].strip() or None
-                    except:
-                        pass
-            else:
-                raise ValueError("Invalid token format")
-        except Exception as e:
-            print(f"Error decoding Apple token: {e}")
-            return RedirectResponse(f"{frontend_url}/signin?error=oauth_failed")
-    elif code:
-        # Exchange code for token (if using code flow)
+    # Code flow: exchange the code for an id_token first
+    if not id_token and code:
         try:
-            async with httpx.AsyncClient() as client:
-                token_resp = await client.post(
-                    "https://appleid.apple.com/auth/token",
-                    data={
-                        "client_id": client_id,
-                        "client_secret": client_secret,
-                        "code": code,
-                        "grant_type": "authorization_code",
-                        "redirect_uri": redirect_uri
-                    },
-                    headers={"Content-Type": "application/x-www-form-urlencoded"}
-                )
-                
-                if not token_resp.is_success:
-                    return RedirectResponse(f"{frontend_url}/signin?error=oauth_failed")
-                
-                token_data = token_resp.json()
-                id_token = token_data.get("id_token")
-                
-                if not id_token:
-                    return RedirectResponse(f"{frontend_url}/signin?error=oauth_failed")
-                
-                # Decode id_token
-                parts = id_token.split('.')
-                if len(parts) == 3:
-                    payload = parts[1]
-                    padding = 4 - len(payload) % 4
-                    if padding != 4:
-                        payload += '=' * padding
-                    decoded = base64.urlsafe_b64decode(payload)
-                    apple_user_data = json.loads(decoded)
-                    
-                    apple_user = {
-                        "id": apple_user_data.get("sub"),
-                        "email": apple_user_data.get("email"),
-                        "name": None
-                    }
-                else:
-                    return RedirectResponse(f"{frontend_url}/signin?error=oauth_failed")
+            token_resp = await OAUTH_CLIENT.post(
+                "https://appleid.apple.com/auth/token",
+                data={
+                    "client_id": APPLE_CLIENT_ID,
+                    "client_secret": APPLE_CLIENT_SECRET,
+                    "code": code,
+                    "grant_type": "authorization_code",
+                    "redirect_uri": APPLE_REDIRECT_URI
+                },
+                headers={"Content-Type": "application/x-www-form-urlencoded"}
+            )
+            
+            if not token_resp.is_success:
+                return RedirectResponse(f"{FRONTEND_URL}/signin?error=oauth_failed")
+            
+            id_token = orjson.loads(token_resp.content).get("id_token")
         except Exception as e:
-            print(f"Error exchanging Apple code: {e}")
-            return RedirectResponse(f"{frontend_url}/signin?error=oauth_failed")
-    else:
-        return RedirectResponse(f"{frontend_url}/signin?error=oauth_failed")
+            logger.error("Error exchanging Apple code: %s", e, exc_info=True)
+            return RedirectResponse(f"{FRONTEND_URL}/signin?error=oauth_failed")
     
-    if not apple_user or not apple_user.get("id"):
-        return RedirectResponse(f"{frontend_url}/signin?error=oauth_failed")
+    if not id_token:
+        return RedirectResponse(f"{FRONTEND_URL}/signin?error=oauth_failed")
     
-    # Find or create user
-    engine = get_engine()
-    with engine.connect() as conn:
-        user = conn.execute(
-            text("""
-                SELECT id, email, name, oauth_provider
-                FROM users
-                WHERE oauth_id = :oauth_id AND oauth_provider = 'apple'
-            """),
-            {"oauth_id": apple_user["id"]}
-        ).mappings().first()
-        
-        if not user:
-            # Check if email exists
-            existing_email = None
-            if apple_user.get("email"):
-                existing_email = conn.execute(
-                    text("SELECT id FROM users WHERE email = :email"),
-                    {"email": apple_user["email"].lower()}
-                ).mappings().first()
-            
-            if existing_email:
-                # Link OAuth to existing account
-                conn.execute(
-                    text("""
-                        UPDATE users
-                        SET oauth_provider = 'apple', oauth_id = :oauth_id
-                        WHERE id = :user_id
-                    """),
-                    {
-                        "oauth_id": apple_user["id"],
-                        "user_id": existing_email["id"]
-                    }
-                )
-                user_id = existing_email["id"]
-            else:
-                # Create new user
-                # Apple may not provide email on subsequent logins
-                email = apple_user.get("email") or f"{apple_user['id']}@apple.privaterelay.appleid.com"
-                result = conn.execute(
-                    text("""
-                        INSERT INTO users (email, name, oauth_provider, oauth_id)
-                        VALUES (:email, :name, 'apple', :oauth_id)
-                        RETURNING id, email, name, oauth_provider
-                    """),
-                    {
-                        "email": email.lower(),
-                        "name": apple_user.get("name"),
-                        "oauth_id": apple_user["id"]
-                    }
-                )
-                user = result.mappings().first()
-                user_id = user["id"]
-        else:
-            user_id = user["id"]
-        
-        conn.commit()
+    try:
+        apple_user_data = await verify_apple_id_token(id_token, APPLE_CLIENT_ID)
+    except Exception as e:
+        logger.error("Error decoding Apple token: %s", e, exc_info=True)
+        return RedirectResponse(f"{FRONTEND_URL}/signin?error=oauth_failed")
+    
+    apple_user = {
+        "id": apple_user_data.get("sub"),
+        "email": apple_user_data.get("email"),
+        "name": apple_user_name(user)
+    }
+    
+    if not apple_user["id"]:
+        return RedirectResponse(f"{FRONTEND_URL}/signin?error=oauth_failed")
+    
+    # Apple may not provide email on subsequent logins
+    account = await find_or_create_oauth_user(
+        "apple",
+        apple_user["id"],
+        apple_user.get("email") or f"{apple_user['id']}@apple.privaterelay.appleid.com",
+        apple_user.get("name")
+    )
     
     # Create tokens
-    access_token_jwt = create_access_token(data={"sub": user_id})
-    refresh_token = create_refresh_token(data={"sub": user_id})
-    save_refresh_token(user_id, refresh_token)
+    access_token_jwt = create_access_token(data=user_token_claims(account))
+    refresh_token = create_refresh_token(data={"sub": str(account["id"])})
+    await save_refresh_token(account["id"], refresh_token)
     
     return RedirectResponse(
-        f"{frontend_url}/auth/callback?access_token={access_token_jwt}&refresh_token={refresh_token}"
+        f"{FRONTEND_URL}/auth/callback?access_token={access_token_jwt}&refresh_token={refresh_token}"
     )
 
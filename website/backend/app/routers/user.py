@@ -4,32 +4,173 @@ User interaction routes for saving/viewing properties.
 
 from __future__ import annotations
 
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime, timezone
 from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from pydantic import BaseModel
-from sqlalchemy import create_engine, text
-from sqlalchemy.engine import Engine
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import Response
+from pydantic import BaseModel, Field
+from sqlalchemy import text
 
 from app.auth import get_current_user
+from app.cache import PREFERENCES_CACHE, PROFILE_CACHE, SAVED_IDS_CACHE, cache_key, cached
+from app.database import get_engine
 
 router = APIRouter(prefix="/user", tags=["user"])
 
-
-def get_engine() -> Engine:
-    """Get database engine."""
-    import os
-    from dotenv import load_dotenv
-    load_dotenv()
-    database_url = os.getenv("DATABASE_URL")
-    if not database_url:
-        raise RuntimeError("DATABASE_URL environment variable is required.")
-    return create_engine(database_url, pool_pre_ping=True)
+logger = logging.getLogger(__name__)
+
+# Saved/viewed/interaction lists return pages of at most this many rows, newest first;
+# when there are more, the X-Next-Offset header gives the offset of the next page
+LIST_LIMIT = 200
+
+# Property views are buffered and written in batches by flush_views_forever()
+VIEW_FLUSH_INTERVAL_SECONDS = 0.5
+VIEW_FLUSH_BATCH_SIZE = 500
+# Bounds memory if flushing falls behind: once full, new views push out the oldest. A batch
+# put back after cancellation goes in at the front, so if the buffer filled meanwhile it is
+# the newest views that are pushed out instead
+_pending_views: deque[tuple[int, int, datetime]] = deque(maxlen=50_000)
+# Set when a full batch is waiting; created by flush_views_forever() on the serving loop
+_views_ready: Optional[asyncio.Event] = None
+
+# SQL statements, compiled once
+# One view per user, property and day: bumps today's row if there is one, else inserts.
+# Views from users deleted since they were buffered are skipped rather than failing the batch
+LOG_VIEWS_STMT = text("""
+    WITH batch AS (
+        SELECT user_id, property_id, max(viewed_at) AS viewed_at
+        FROM unnest(
+            CAST(:user_ids AS integer[]),
+            CAST(:property_ids AS integer[]),
+            CAST(:viewed_at AS timestamptz[])
+        ) AS b(user_id, property_id, viewed_at)
+        WHERE EXISTS (SELECT 1 FROM users WHERE users.id = b.user_id)
+        GROUP BY user_id, property_id
+    ), bumped AS (
+        UPDATE user_interactions ui
+        SET created_at = batch.viewed_at
+        FROM batch
+        WHERE ui.user_id = batch.user_id
+          AND ui.property_id = batch.property_id
+          AND ui.interaction_type = 'viewed'
+          AND DATE(ui.created_at) = CURRENT_DATE
+        RETURNING ui.user_id, ui.property_id
+    )
+    INSERT INTO user_interactions (user_id, property_id, interaction_type, created_at)
+    SELECT user_id, property_id, 'viewed', viewed_at
+    FROM batch
+    WHERE NOT EXISTS (
+        SELECT 1 FROM bumped
+        WHERE bumped.user_id = batch.user_id AND bumped.property_id = batch.property_id
+    )
+""")
+SELECT_PROFILE_STMT = text("SELECT id, email, name, phone, avatar_url FROM users WHERE id = :user_id")
+UPDATE_PROFILE_STMT = text("""
+    UPDATE users
+    SET name = COALESCE(:name, name),
+        phone = COALESCE(:phone, phone),
+        avatar_url = COALESCE(:avatar_url, avatar_url)
+    WHERE id = :user_id
+    RETURNING id, email, name, phone, avatar_url
+""")
+SAVE_PROPERTY_STMT = text("""
+    WITH saved AS (
+        INSERT INTO saved_properties (user_id, property_no)
+        VALUES (:user_id, :property_id)
+        ON CONFLICT (user_id, property_no) DO NOTHING
+        RETURNING user_id, property_no
+    )
+    INSERT INTO user_interactions (user_id, property_id, interaction_type)
+    SELECT user_id, property_no, 'saved' FROM saved
+    RETURNING id
+""")
+DELETE_SAVED_PROPERTY_STMT = text("""
+    DELETE FROM saved_properties
+    WHERE user_id = :user_id AND property_no = :property_id
+""")
+# The list statements read one row past the page to tell whether another page follows
+SELECT_SAVED_JSON_STMT = text("""
+    WITH page AS (
+        SELECT sp.property_no AS id,
+               sp.created_at AS saved_at,
+               re.price,
+               re.location,
+               re.num_rooms,
+               re.num_bathrooms,
+               NULLIF(re.floor_area_m2, 'NaN') AS floor_area_m2,
+               NULLIF(re.smart_living_score, 'NaN') AS smart_living_score,
+               re.property_type
+        FROM saved_properties sp
+        LEFT JOIN real_estate_data re ON re.no = sp.property_no
+        WHERE sp.user_id = :user_id
+        ORDER BY sp.created_at DESC
+        LIMIT :limit + 1 OFFSET :offset
+    )
+    SELECT COALESCE((
+               SELECT json_agg(t ORDER BY t.saved_at DESC)
+               FROM (SELECT * FROM page ORDER BY saved_at DESC LIMIT :limit) t
+           ), '[]')::text AS body,
+           (SELECT count(*) FROM page) > :limit AS has_more
+""")
+SELECT_VIEWED_JSON_STMT = text("""
+    WITH page AS (
+        SELECT *
+        FROM (
+            SELECT DISTINCT ON (ui.property_id)
+                   ui.property_id AS id,
+                   ui.created_at,
+                   re.price,
+                   re.location,
+                   re.num_rooms,
+                   re.num_bathrooms,
+                   NULLIF(re.floor_area_m2, 'NaN') AS floor_area_m2,
+                   NULLIF(re.smart_living_score, 'NaN') AS smart_living_score,
+                   re.property_type
+            FROM user_interactions ui
+            LEFT JOIN real_estate_data re ON re.no = ui.property_id
+            WHERE ui.user_id = :user_id
+              AND ui.interaction_type = 'viewed'
+              AND ui.property_id IS NOT NULL
+            ORDER BY ui.property_id, ui.created_at DESC NULLS LAST
+        ) latest
+        ORDER BY created_at DESC NULLS LAST
+        LIMIT :limit + 1 OFFSET :offset
+    )
+    SELECT COALESCE((
+               SELECT json_agg(t ORDER BY t.created_at DESC NULLS LAST)
+               FROM (SELECT * FROM page ORDER BY created_at DESC NULLS LAST LIMIT :limit) t
+           ), '[]')::text AS body,
+           (SELECT count(*) FROM page) > :limit AS has_more
+""")
+SELECT_SAVED_IDS_STMT = text("SELECT property_no FROM saved_properties WHERE user_id = :user_id")
+SELECT_INTERACTIONS_JSON_STMT = text("""
+    WITH page AS (
+        SELECT property_id, interaction_type, created_at
+        FROM user_interactions
+        WHERE user_id = :user_id
+        ORDER BY created_at DESC
+        LIMIT :limit + 1 OFFSET :offset
+    )
+    SELECT COALESCE((
+               SELECT json_agg(json_build_object(
+                          'property_id', property_id,
+                          'interaction_type', interaction_type,
+                          'created_at', COALESCE(to_json(created_at) #>> '{}', '')
+                      ) ORDER BY created_at DESC)
+               FROM (SELECT * FROM page ORDER BY created_at DESC LIMIT :limit) t
+           ), '[]')::text AS body,
+           (SELECT count(*) FROM page) > :limit AS has_more
+""")
 
 
 # Request/Response Models
 class SavePropertyRequest(BaseModel):
-    property_id: int
+    # Bounded to Postgres integer so a bad id is a 422, not a failed insert
+    property_id: int = Field(gt=0, le=2**31 - 1)
 
 
 class PropertyInteraction(BaseModel):
@@ -52,65 +193,58 @@ class UpdateProfileRequest(BaseModel):
     avatar_url: Optional[str] = None
 
 
-def ensure_profile_columns(conn) -> None:
-    """Ensure optional profile fields exist without breaking deployments."""
-    conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS phone TEXT"))
-    conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS avatar_url TEXT"))
-
-
 @router.get("/me", response_model=UserProfile)
 async def get_profile(current_user: dict = Depends(get_current_user)):
+    profile = PROFILE_CACHE.get(current_user["id"])
+    if profile is not None:
+        return profile
+
+    # Taken before the read so an update committing meanwhile keeps this row out of the cache
+    version = PROFILE_CACHE.version(current_user["id"])
     engine = get_engine()
-    with engine.connect() as conn:
-        ensure_profile_columns(conn)
-        result = conn.execute(
-            text(
-                "SELECT id, email, name, phone, avatar_url FROM users WHERE id = :user_id"
-            ),
+    async with engine.connect() as conn:
+        result = (await conn.execute(
+            SELECT_PROFILE_STMT,
             {"user_id": current_user["id"]},
-        ).mappings().first()
+        )).mappings().first()
 
     if not result:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
 
-    return UserProfile(**dict(result))
+    profile = UserProfile.model_construct(**result)
+    PROFILE_CACHE.set(current_user["id"], profile, version=version)
+    return profile
 
 
 @router.patch("/update", response_model=UserProfile)
 async def update_profile(
     payload: UpdateProfileRequest, current_user: dict = Depends(get_current_user)
 ):
+    """Update the current user's profile.
+
+    /auth/me reads the name from the access token, so clients refresh their token
+    after an update to see the new name there.
+    """
     engine = get_engine()
-    with engine.connect() as conn:
-        ensure_profile_columns(conn)
-        conn.execute(
-            text(
-                """
-                UPDATE users
-                SET name = COALESCE(:name, name),
-                    phone = COALESCE(:phone, phone),
-                    avatar_url = COALESCE(:avatar_url, avatar_url)
-                WHERE id = :user_id
-                """
-            ),
+    async with engine.begin() as conn:
+        result = (await conn.execute(
+            UPDATE_PROFILE_STMT,
             {
                 "name": payload.name,
                 "phone": payload.phone,
                 "avatar_url": payload.avatar_url,
                 "user_id": current_user["id"],
             },
-        )
-        conn.commit()
-
-        result = conn.execute(
-            text("SELECT id, email, name, phone, avatar_url FROM users WHERE id = :user_id"),
-            {"user_id": current_user["id"]},
-        ).mappings().first()
+        )).mappings().first()
 
     if not result:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
 
-    return UserProfile(**dict(result))
+    profile = UserProfile.model_construct(**result)
+    # Popped first so a read that started before the update can't cache the old row
+    PROFILE_CACHE.pop(current_user["id"])
+    PROFILE_CACHE.set(current_user["id"], profile)
+    return profile
 
 
 class SavedPropertyResponse(BaseModel):
@@ -127,39 +261,19 @@ async def save_property(
     engine = get_engine()
     user_id = current_user["id"]
     
-    with engine.connect() as conn:
-        # Check if already saved
-        existing = conn.execute(
-            text("""
-                SELECT user_id FROM saved_properties
-                WHERE user_id = :user_id AND property_no = :property_id
-            """),
-            {"user_id": user_id, "property_id": request.property_id}
-        ).mappings().first()
-        
-        if existing:
-            return {"message": "Property already saved"}
-        
-        # Save property
-        conn.execute(
-            text("""
-                INSERT INTO saved_properties (user_id, property_no)
-                VALUES (:user_id, :property_id)
-            """),
+    async with engine.begin() as conn:
+        # Save property and log the interaction in one statement; the
+        # (user_id, property_no) primary key makes repeats a no-op for both
+        saved = (await conn.execute(
+            SAVE_PROPERTY_STMT,
             {"user_id": user_id, "property_id": request.property_id}
-        )
-        
-        # Log interaction
-        conn.execute(
-            text("""
-                INSERT INTO user_interactions (user_id, property_id, interaction_type)
-                VALUES (:user_id, :property_id, 'saved')
-            """),
-            {"user_id": user_id, "property_id": request.property_id}
-        )
-        
-        conn.commit()
+        )).first()
     
+    if saved is None:
+        return {"message": "Property already saved"}
+    
+    SAVED_IDS_CACHE.pop(cache_key(user_id))
+    PREFERENCES_CACHE.pop(user_id)
     return {"message": "Property saved successfully"}
 
 
@@ -172,16 +286,15 @@ async def unsave_property(
     engine = get_engine()
     user_id = current_user["id"]
     
-    with engine.connect() as conn:
-        conn.execute(
-            text("""
-                DELETE FROM saved_properties
-                WHERE user_id = :user_id AND property_no = :property_id
-            """),
+    async with engine.connect() as conn:
+        await conn.execute(
+            DELETE_SAVED_PROPERTY_STMT,
             {"user_id": user_id, "property_id": property_id}
         )
-        conn.commit()
+        await conn.commit()
     
+    SAVED_IDS_CACHE.pop(cache_key(user_id))
+    PREFERENCES_CACHE.pop(user_id)
     return {"message": "Property removed from saved"}
 
 
@@ -190,159 +303,134 @@ async def view_property(
     request: SavePropertyRequest,
     current_user: dict = Depends(get_current_user)
 ):
-    """Log that a user viewed a property."""
-    engine = get_engine()
-    user_id = current_user["id"]
-    
-    with engine.connect() as conn:
-        # Check if this view already exists today (to avoid duplicate entries)
-        # If it exists, update the timestamp; otherwise insert new
-        existing = conn.execute(
-            text("""
-                SELECT id FROM user_interactions
-                WHERE user_id = :user_id 
-                AND property_id = :property_id 
-                AND interaction_type = 'viewed'
-                AND DATE(created_at) = CURRENT_DATE
-            """),
-            {"user_id": user_id, "property_id": request.property_id}
-        ).mappings().first()
-        
-        if not existing:
-            # Insert new view
-            conn.execute(
-                text("""
-                    INSERT INTO user_interactions (user_id, property_id, interaction_type)
-                    VALUES (:user_id, :property_id, 'viewed')
-                """),
-                {"user_id": user_id, "property_id": request.property_id}
-            )
-        else:
-            # Update timestamp of existing view
-            conn.execute(
-                text("""
-                    UPDATE user_interactions
-                    SET created_at = CURRENT_TIMESTAMP
-                    WHERE id = :id
-                """),
-                {"id": existing["id"]}
-            )
-        conn.commit()
-
+    """Log that a user viewed a property (written in the next batch)."""
+    _pending_views.append((current_user["id"], request.property_id, datetime.now(timezone.utc)))
+    if len(_pending_views) >= VIEW_FLUSH_BATCH_SIZE and _views_ready is not None:
+        _views_ready.set()
     return {"message": "View logged"}
 
 
+async def log_views(params: dict) -> None:
+    """Write one batch of views."""
+    engine = get_engine()
+    async with engine.begin() as conn:
+        await conn.execute(LOG_VIEWS_STMT, params)
+
+
+async def flush_views() -> None:
+    """Write all buffered views, one statement per batch.
+
+    A failed batch is retried once and then dropped, so it can't block the views behind it.
+    A batch interrupted by cancellation is put back for the shutdown flush.
+    """
+    while _pending_views:
+        batch = [_pending_views.popleft() for _ in range(min(len(_pending_views), VIEW_FLUSH_BATCH_SIZE))]
+        user_ids, property_ids, viewed_at = (list(column) for column in zip(*batch))
+        params = {"user_ids": user_ids, "property_ids": property_ids, "viewed_at": viewed_at}
+        try:
+            try:
+                await log_views(params)
+            except Exception as e:
+                logger.warning("Retrying %d property views after error: %s", len(batch), e)
+                await log_views(params)
+        except asyncio.CancelledError:
+            _pending_views.extendleft(reversed(batch))
+            raise
+        except Exception as e:
+            logger.error("Dropping %d property views: %s", len(batch), e, exc_info=True)
+            continue
+        for user_id in set(user_ids):
+            PREFERENCES_CACHE.pop(user_id)
+
+
+async def flush_views_forever() -> None:
+    """Flush buffered views every VIEW_FLUSH_INTERVAL_SECONDS, or sooner once a batch fills."""
+    global _views_ready
+    _views_ready = asyncio.Event()
+    while True:
+        try:
+            await asyncio.wait_for(_views_ready.wait(), VIEW_FLUSH_INTERVAL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _views_ready.clear()
+        try:
+            await flush_views()
+        except Exception as e:
+            logger.error("Error logging property views: %s", e, exc_info=True)
+
+
+def list_page_response(body: str, has_more: bool, offset: int) -> Response:
+    """Serve one page of a Postgres-built JSON list, pointing at the next page if any."""
+    headers = {"X-Next-Offset": str(offset + LIST_LIMIT)} if has_more else None
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
 @router.get("/saved")
-async def get_saved(current_user: dict = Depends(get_current_user)):
+async def get_saved(
+    offset: int = Query(default=0, ge=0, description="Rows to skip, for paging past the first page"),
+    current_user: dict = Depends(get_current_user)
+):
     engine = get_engine()
     user_id = current_user["id"]
 
-    with engine.connect() as conn:
-        results = conn.execute(
-            text(
-                """
-                SELECT sp.property_no AS id,
-                       sp.created_at AS saved_at,
-                       re.price,
-                       re.location,
-                       re.num_rooms,
-                       re.num_bathrooms,
-                       re.floor_area_m2,
-                       re.smart_living_score,
-                       re.property_type
-                FROM saved_properties sp
-                LEFT JOIN real_estate_data re ON re.no = sp.property_no
-                WHERE sp.user_id = :user_id
-                ORDER BY sp.created_at DESC
-                """
-            ),
-            {"user_id": user_id},
-        ).mappings().all()
-
-    return [dict(row) for row in results]
+    # Postgres builds the JSON array, so rows are never materialized in Python
+    async with engine.connect() as conn:
+        body, has_more = (await conn.execute(
+            SELECT_SAVED_JSON_STMT,
+            {"user_id": user_id, "limit": LIST_LIMIT, "offset": offset},
+        )).one()
+
+    return list_page_response(body, has_more, offset)
 
 
 @router.get("/viewed")
-async def get_viewed(current_user: dict = Depends(get_current_user)):
+async def get_viewed(
+    offset: int = Query(default=0, ge=0, description="Rows to skip, for paging past the first page"),
+    current_user: dict = Depends(get_current_user)
+):
     engine = get_engine()
     user_id = current_user["id"]
 
-    with engine.connect() as conn:
-        results = conn.execute(
-            text(
-                """
-                SELECT ui.property_id AS id,
-                       ui.created_at,
-                       re.price,
-                       re.location,
-                       re.num_rooms,
-                       re.num_bathrooms,
-                       re.floor_area_m2,
-                       re.smart_living_score,
-                       re.property_type
-                FROM user_interactions ui
-                LEFT JOIN real_estate_data re ON re.no = ui.property_id
-                WHERE ui.user_id = :user_id AND ui.interaction_type = 'viewed'
-                ORDER BY ui.created_at DESC
-                """
-            ),
-            {"user_id": user_id},
-        ).mappings().all()
-
-    # Remove duplicates (same property viewed multiple times) and keep most recent
-    seen = {}
-    unique_results = []
-    for row in results:
-        prop_id = row["id"]
-        if prop_id and prop_id not in seen:
-            seen[prop_id] = True
-            unique_results.append(row)
-    
-    # Sort by created_at descending (most recent first)
-    unique_results.sort(key=lambda x: x["created_at"] if x["created_at"] else "", reverse=True)
+    # Most recent view per property, newest first, serialized by Postgres
+    async with engine.connect() as conn:
+        body, has_more = (await conn.execute(
+            SELECT_VIEWED_JSON_STMT,
+            {"user_id": user_id, "limit": LIST_LIMIT, "offset": offset},
+        )).one()
 
-    return [dict(row) for row in unique_results]
+    return list_page_response(body, has_more, offset)
 
 
 @router.get("/saved-properties", response_model=List[int])
 async def get_saved_properties(current_user: dict = Depends(get_current_user)):
     """Get list of saved property IDs for current user."""
+    return await saved_property_ids(current_user["id"])
+
+
+# Every listing card asks for these, so concurrent misses share one query
+@cached(SAVED_IDS_CACHE, cache_if=None)
+async def saved_property_ids(user_id: int) -> List[int]:
     engine = get_engine()
-    user_id = current_user["id"]
-    
-    with engine.connect() as conn:
-        results = conn.execute(
-            text("SELECT property_no FROM saved_properties WHERE user_id = :user_id"),
+    async with engine.connect() as conn:
+        return list((await conn.execute(
+            SELECT_SAVED_IDS_STMT,
             {"user_id": user_id}
-        ).mappings().all()
-    
-    return [row["property_no"] for row in results]
+        )).scalars())
 
 
 @router.get("/interactions", response_model=List[PropertyInteraction])
-async def get_user_interactions(current_user: dict = Depends(get_current_user)):
+async def get_user_interactions(
+    offset: int = Query(default=0, ge=0, description="Rows to skip, for paging past the first page"),
+    current_user: dict = Depends(get_current_user)
+):
     """Get all user interactions."""
     engine = get_engine()
     user_id = current_user["id"]
     
-    with engine.connect() as conn:
-        results = conn.execute(
-            text("""
-                SELECT property_id, interaction_type, created_at
-                FROM user_interactions
-                WHERE user_id = :user_id
-                ORDER BY created_at DESC
-            """),
-            {"user_id": user_id}
-        ).mappings().all()
+    async with engine.connect() as conn:
+        body, has_more = (await conn.execute(
+            SELECT_INTERACTIONS_JSON_STMT,
+            {"user_id": user_id, "limit": LIST_LIMIT, "offset": offset}
+        )).one()
     
-    return [
-        PropertyInteraction(
-            property_id=row["property_id"],
-            interaction_type=row["interaction_type"],
-            created_at=row["created_at"].isoformat() if row["created_at"] else ""
-        )
-        for row in results
-    ]
-
-
+    return list_page_response(body, has_more, offset)
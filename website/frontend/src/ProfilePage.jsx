@@ -2,12 +2,13 @@ import { useEffect, useState } from 'react'
 import { useNavigate } from 'react-router-dom'
 import NavBar from './components/NavBar'
 import useAuth from './hooks/useAuth'
+import fetchAllPages from './utils/fetchAllPages'
 import './components/Profile.css'
 
 const API_BASE_URL = import.meta.env.VITE_API_URL ?? 'http://localhost:8000'
 
 function ProfilePage() {
-  const { isAuthenticated, token, user, loading } = useAuth()
+  const { isAuthenticated, token, user, loading, refresh } = useAuth()
   const navigate = useNavigate()
   const [profile, setProfile] = useState({ name: user?.name || '', email: user?.email || '', phone: '', avatar_url: '' })
   const [status, setStatus] = useState('')
@@ -24,10 +25,11 @@ function ProfilePage() {
     async function loadProfile() {
       if (!token) return
       try {
-        const [profileRes, savedRes, viewedRes] = await Promise.all([
+        // The lists are paged, so fetch every page to count them; a failed list leaves its count alone
+        const [profileRes, saved, viewed] = await Promise.all([
           fetch(`${API_BASE_URL}/user/me`, { headers: { Authorization: `Bearer ${token}` } }),
-          fetch(`${API_BASE_URL}/user/saved`, { headers: { Authorization: `Bearer ${token}` } }),
-          fetch(`${API_BASE_URL}/user/viewed`, { headers: { Authorization: `Bearer ${token}` } }),
+          fetchAllPages(`${API_BASE_URL}/user/saved`, { headers: { Authorization: `Bearer ${token}` } }).catch(() => null),
+          fetchAllPages(`${API_BASE_URL}/user/viewed`, { headers: { Authorization: `Bearer ${token}` } }).catch(() => null),
         ])
 
         if (profileRes.ok) {
@@ -40,14 +42,12 @@ function ProfilePage() {
           })
         }
 
-        if (savedRes.ok) {
-          const saved = await savedRes.json()
-          setSavedCount(Array.isArray(saved) ? saved.length : 0)
+        if (saved) {
+          setSavedCount(saved.length)
         }
 
-        if (viewedRes.ok) {
-          const viewed = await viewedRes.json()
-          setViewedCount(Array.isArray(viewed) ? viewed.length : 0)
+        if (viewed) {
+          setViewedCount(viewed.length)
         }
       } catch (error) {
         console.error('Profile load failed', error)
@@ -72,6 +72,8 @@ function ProfilePage() {
 
       if (response.ok) {
         setStatus('Profile updated')
+        // The access token carries the name, so get a fresh one for /auth/me and the nav bar
+        await refresh()
       } else {
         setStatus('Unable to save changes right now')
       }
@@ -54,13 +54,12 @@ function PropertyDetailsPage() {
     async function loadSavedState() {
       if (!token) return
       try {
-        const response = await fetch(`${API_BASE_URL}/user/saved`, {
+        const response = await fetch(`${API_BASE_URL}/user/saved-properties`, {
           headers: { Authorization: `Bearer ${token}` },
         })
         if (!response.ok) return
-        const data = await response.json()
-        const ids = Array.isArray(data) ? data.map((item) => item.id) : []
-        setIsSaved(ids.includes(Number(id)))
+        const ids = await response.json()
+        setIsSaved(Array.isArray(ids) && ids.includes(Number(id)))
       } catch (err) {
         console.error('Failed to load saved properties', err)
       }
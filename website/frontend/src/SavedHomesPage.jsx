@@ -3,6 +3,7 @@ import { useNavigate } from 'react-router-dom'
 import NavBar from './components/NavBar'
 import useAuth from './hooks/useAuth'
 import getPropertyImage from './utils/propertyImages'
+import fetchAllPages from './utils/fetchAllPages'
 import './components/SavedHomes.css'
 
 const API_BASE_URL = import.meta.env.VITE_API_URL ?? 'http://localhost:8000'
@@ -21,11 +22,8 @@ function SavedHomesPage() {
     async function loadHomes() {
       if (!token) return
       try {
-        const response = await fetch(`${API_BASE_URL}/user/saved`, { headers: { Authorization: `Bearer ${token}` } })
-        if (response.ok) {
-          const data = await response.json()
-          setHomes(Array.isArray(data) ? data : [])
-        }
+        const data = await fetchAllPages(`${API_BASE_URL}/user/saved`, { headers: { Authorization: `Bearer ${token}` } })
+        setHomes(data)
       } catch (error) {
         console.error('Failed to load saved homes', error)
       }
@@ -3,6 +3,7 @@ import { useNavigate } from 'react-router-dom'
 import NavBar from './components/NavBar'
 import useAuth from './hooks/useAuth'
 import getPropertyImage from './utils/propertyImages'
+import fetchAllPages from './utils/fetchAllPages'
 import './components/SavedHomes.css'
 
 const API_BASE_URL = import.meta.env.VITE_API_URL ?? 'http://localhost:8000'
@@ -20,16 +21,11 @@ function ViewedHomesPage() {
     async function loadHomes() {
       if (!token) return
       try {
-        const response = await fetch(`${API_BASE_URL}/user/viewed`, { 
+        const data = await fetchAllPages(`${API_BASE_URL}/user/viewed`, { 
           headers: { Authorization: `Bearer ${token}` } 
         })
-        if (response.ok) {
-          const data = await response.json()
-          console.log('Viewed homes data:', data) // Debug log
-          setHomes(Array.isArray(data) ? data : [])
-        } else {
-          console.error('Failed to load viewed homes:', response.status, await response.text())
-        }
+        console.log('Viewed homes data:', data) // Debug log
+        setHomes(data)
       } catch (error) {
         console.error('Failed to load viewed homes', error)
       }
@@ -131,13 +131,15 @@ function POIExplorer({ propertyLat, propertyLng }) {
               const poiLat = place.geometry.location.lat
               const poiLng = place.geometry.location.lng
 
-              // Calculate straight-line distance
-              const distance = calculateDistance(
-                propertyCenter.lat,
-                propertyCenter.lng,
-                poiLat,
-                poiLng
-              )
+              // Straight-line distance (computed by the API when available)
+              const distance = place.distance_km != null
+                ? place.distance_km.toFixed(2)
+                : calculateDistance(
+                    propertyCenter.lat,
+                    propertyCenter.lng,
+                    poiLat,
+                    poiLng
+                  )
 
               // Get travel times using Google Distance Matrix API
               let travelTimes = { walking: null, driving: null, transit: null }
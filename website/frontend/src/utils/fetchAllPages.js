@@ -0,0 +1,20 @@
+// Utility function to fetch every page of a paged /user list endpoint
+// The API returns up to 200 rows per page and sets X-Next-Offset while more remain
+export const fetchAllPages = async (url, options) => {
+  const items = []
+  let offset = 0
+  while (offset !== null) {
+    const separator = url.includes('?') ? '&' : '?'
+    const response = await fetch(`${url}${separator}offset=${offset}`, options)
+    if (!response.ok) {
+      throw new Error(`Request failed with status ${response.status}`)
+    }
+    const page = await response.json()
+    if (Array.isArray(page)) items.push(...page)
+    const nextOffset = response.headers.get('X-Next-Offset')
+    offset = nextOffset === null ? null : Number(nextOffset)
+  }
+  return items
+}
+
+export default fetchAllPages